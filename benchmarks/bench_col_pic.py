@@ -0,0 +1,54 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+"""
+Benchmark of lib_col_pic encoder on high color count thumbnails
+
+    python benchmarks/bench_col_pic.py [--repeat N] [--no-numpy]
+"""
+
+import argparse
+import sys
+import time
+
+from array import array
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import lib_col_pic
+
+from synthetic import gradient_image
+
+
+def bench(color16, width, height, colorsmax, repeat) -> float:
+    best = None
+    for _ in range(repeat):
+        data = array('H', color16)
+        buffer_size = width * height * 10
+        buffer = bytearray(buffer_size)
+        start = time.perf_counter()
+        lib_col_pic.ColPic_EncodeStr(data, width, height, buffer, buffer_size, colorsmax)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=path.basename(__file__))
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per case (best is reported)')
+    parser.add_argument('--no-numpy', default=False, action='store_true', help='Benchmark pure Python fallback')
+    args = parser.parse_args()
+
+    if not args.no_numpy:
+        lib_col_pic.enable_numpy()
+
+    print(f'numpy: {lib_col_pic.np is not None}')
+    print(f'{"size":>9} {"noise":>5} {"colors":>6} {"colorsmax":>9} {"seconds":>9}')
+    for width, height in ((200, 200), (160, 160)):
+        for noise in (0, 2, 6):
+            color16 = gradient_image(width, height, noise)
+            colors = len(set(color16))
+            for colorsmax in (1024, 256, 64):
+                elapsed = bench(color16, width, height, colorsmax, args.repeat)
+                print(f'{width:>4}x{height:<4} {noise:>5} {colors:>6} {colorsmax:>9} {elapsed:>9.4f}')
@@ -0,0 +1,55 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+"""
+Benchmark of the whole g-code rewrite: two pass (default) vs single pass
+
+    python benchmarks/bench_run.py [--size MB ...] [--repeat N]
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import synthetic
+import thumbnail
+
+
+def bench(source, options, repeat) -> float:
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = path.join(tmp_dir, 'bench.gcode')
+            shutil.copyfile(source, input_file)
+            start = time.perf_counter()
+            thumbnail.Neptune_Thumbnail(input_file, update_original_image=True, **options).run()
+            elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=path.basename(__file__))
+    parser.add_argument('--size', type=float, nargs='+', default=[1, 10, 100], help='Sizes of generated g-code files in MB')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per case (best is reported)')
+    args = parser.parse_args()
+
+    modes = {
+        'two pass': {},
+        'single pass': {'single_pass': True},
+    }
+    print(f'{"size MB":>8} {"mode":>12} {"seconds":>9} {"MB/s":>8}')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in args.size:
+            source = path.join(tmp_dir, f'source-{size_mb}.gcode')
+            synthetic.gcode(source, size_mb)
+            actual_mb = path.getsize(source) / 1024 / 1024
+            for mode, options in modes.items():
+                elapsed = bench(source, options, args.repeat)
+                print(f'{actual_mb:>8.1f} {mode:>12} {elapsed:>9.3f} {actual_mb / elapsed:>8.1f}')
@@ -0,0 +1,169 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+"""
+Per-stage benchmark on synthetic PrusaSlicer/OrcaSlicer g-code files, results are written as JSON
+
+    python benchmarks/bench_stages.py [--size MB ...] [--slicer prusa orca] [--img_type PNG JPG QOI]
+                                      [--complexity flat shapes noise] [--bgcode] [--compression gzip zstd]
+                                      [--repeat N] [--output results.json]
+
+Sizes from 1 MB to more than 1 GB are supported (e.g. --size 1 100 1100), files are generated in --tmp_dir
+(binary g-code compression is pure Python, so --bgcode takes long for big sizes). Compressed files are
+rewritten compressed the same way.
+Stage times are the best of repeated runs in seconds, nested stages are included into outer ones
+(e.g. image_encode_new:gimage into image_blocks, image_blocks into write_header, everything into run).
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timezone
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import PIL
+
+import lib_col_pic
+import lib_compress
+import synthetic
+import thumbnail
+
+
+def best_of(func, repeat) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_pipeline(source, options, repeat, tmp_dir) -> dict:
+    """
+    Best time of every Neptune_Thumbnail stage over repeated runs
+    """
+    best = {}
+    for _ in range(repeat):
+        input_file = path.join(tmp_dir, 'bench' + path.splitext(source)[1])
+        shutil.copyfile(source, input_file)
+        obj = thumbnail.Neptune_Thumbnail(input_file, update_original_image=True, **options)
+        obj.run()
+        for stage, elapsed in obj.timings.items():
+            if stage not in best or elapsed < best[stage]:
+                best[stage] = elapsed
+    return best
+
+
+def bench_col_pic(source, repeat) -> dict:
+    """
+    Best time of lib_col_pic functions encoding 200x200 image of the file
+    """
+    obj = thumbnail.Neptune_Thumbnail(source)
+    obj.parse()
+    obj.prepare()
+    source = obj.thumbnail_source(200)
+    img = obj.image_modify(obj.image_resize(obj.image_composite(obj.image_decode(obj.thumbnail_data(source), source.format, 200), thumbnail.NEPTUNE_BACKGROUND), 200), background=thumbnail.NEPTUNE_BACKGROUND)
+    (width, height) = img.size
+    dotsqty = width * height
+    buffer_size = dotsqty * 10
+    color16 = thumbnail.rgb565_le(img)
+    palette = lib_col_pic.ColPicPalette(lib_col_pic.Color16FromBytes(color16), dotsqty, 1024)
+    buffer = bytearray(buffer_size)
+    encoded_size = lib_col_pic.ColPic_EncodeStr(color16, width, height, buffer, buffer_size, 1024)
+    raw_size = lib_col_pic.ColPicEncode(color16, width, height, bytearray(buffer_size), buffer_size, 1024)
+
+    return {
+        # Palette is limited to 1024 colors
+        'palette_colors': len(palette),
+        'rgb565_le': best_of(lambda: thumbnail.rgb565_le(img), repeat),
+        'Color16FromBytes': best_of(lambda: lib_col_pic.Color16FromBytes(color16), repeat),
+        'ColPicPalette': best_of(lambda: lib_col_pic.ColPicPalette(lib_col_pic.Color16FromBytes(color16), dotsqty, 1024), repeat),
+        'ColPicEncode': best_of(lambda: lib_col_pic.ColPicEncode(color16, width, height, bytearray(buffer_size), buffer_size, 1024), repeat),
+        'ColPicPackStr': best_of(lambda: lib_col_pic.ColPicPackStr(buffer[:raw_size]), repeat),
+        'ColPic_EncodeStr': best_of(lambda: lib_col_pic.ColPic_EncodeStr(color16, width, height, bytearray(buffer_size), buffer_size, 1024), repeat),
+        'colpic_frame': best_of(lambda: thumbnail.colpic_frame(memoryview(buffer)[:encoded_size], ';gimage:'), repeat),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=path.basename(__file__))
+    parser.add_argument('--size', type=float, nargs='+', default=[1, 10, 100], help='Sizes of generated g-code files in MB')
+    parser.add_argument('--slicer', nargs='+', default=list(synthetic.SLICERS), choices=synthetic.SLICERS, help='Slicer flavours of generated files')
+    parser.add_argument('--img_type', nargs='+', default=['PNG', 'JPG'], choices=['PNG', 'JPG', 'QOI'], help='Thumbnail formats (QOI needs Pillow 11.3+)')
+    parser.add_argument('--complexity', nargs='+', default=list(synthetic.COMPLEXITIES), choices=synthetic.COMPLEXITIES, help='Thumbnail color complexity')
+    parser.add_argument('--old_printer', default=False, action='store_true', help='Benchmark old printers mode as well')
+    parser.add_argument('--single_pass', default=False, action='store_true', help='Benchmark single pass mode as well')
+    parser.add_argument('--bgcode', default=False, action='store_true', help='Benchmark conversion of binary g-code (PrusaSlicer defaults) as well')
+    parser.add_argument('--compression', nargs='*', default=[], choices=[lib_compress.GZIP, lib_compress.ZSTD], help='Benchmark compressed g-code as well')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per case (best is reported)')
+    parser.add_argument('--tmp_dir', default=None, help='Directory for generated files (default: system temporary directory)')
+    parser.add_argument('--output', default=None, help='JSON file to write results into (default: stdout)')
+    args = parser.parse_args()
+
+    modes = {'new printer': {}}
+    if args.old_printer:
+        modes['old printer'] = {'old_printer': True}
+    if args.single_pass:
+        modes['single pass'] = {'single_pass': True}
+
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'pillow': PIL.__version__,
+        'numpy': lib_col_pic.np.__version__ if lib_col_pic.np is not None else None,
+        'repeat': args.repeat,
+        'cases': [],
+    }
+
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        for slicer in args.slicer:
+            for img_type in args.img_type:
+                for complexity in args.complexity:
+                    col_pic = None
+                    for size_mb in args.size:
+                        source = path.join(tmp_dir, 'source.gcode')
+                        start = time.perf_counter()
+                        synthetic.gcode(source, size_mb, img_type, slicer=slicer, complexity=complexity)
+                        generated = time.perf_counter() - start
+                        if col_pic is None:
+                            # Thumbnail does not depend on file size
+                            col_pic = bench_col_pic(source, args.repeat)
+                        file_size = path.getsize(source)
+                        sources = {mode: source for mode in modes}
+                        if args.bgcode:
+                            sources['bgcode'] = path.join(tmp_dir, 'source.bgcode')
+                            synthetic.bgcode(sources['bgcode'], source)
+                        for compression in args.compression:
+                            sources[compression] = source + lib_compress.EXTENSIONS[compression]
+                            with open(source, 'rb') as input, lib_compress.open_output(sources[compression], compression) as output:
+                                shutil.copyfileobj(input, output, lib_compress.STREAM_BUFFER_SIZE)
+                        for mode in sources:
+                            stages = bench_pipeline(sources[mode], modes.get(mode, {}), args.repeat, tmp_dir)
+                            results['cases'].append({
+                                'slicer': slicer,
+                                'img_type': img_type,
+                                'complexity': complexity,
+                                'mode': mode,
+                                'size': file_size,
+                                'generate': generated,
+                                'stages': stages,
+                                'lib_col_pic': col_pic,
+                            })
+                            print(f'{slicer:>5} {img_type:>3} {complexity:>6} {file_size / 1024 / 1024:>8.1f} MB {mode:>11}: {stages["run"]:.3f} s', file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w', encoding='utf8') as f:
+            f.write(output + '\n')
@@ -0,0 +1,100 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+"""
+Round-trip check of binary g-code reader: g-code text read by lib_bgcode is compared with the expected one
+
+    python benchmarks/diff_bgcode.py [--size MB] [files ...]
+
+Synthetic files are written by synthetic.bgcode() with all compressions, with & without MeatPack, and compared with
+the source body. Files given (benchmarks/fixtures/*.bgcode by default) are compared with the text g-code next to them
+(the same name with .gcode extension), it is the g-code exported by the slicer from the same project (or converted
+by its bgcode tool). Exit code is 1 when any check fails.
+"""
+
+import argparse
+import glob
+import re
+import sys
+import tempfile
+
+from io import StringIO
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import lib_bgcode
+import synthetic
+
+FIXTURES = path.join(path.dirname(path.abspath(__file__)), 'fixtures')
+COMPRESSIONS = {0: 'none', 1: 'deflate', 2: 'heatshrink 11/4', 3: 'heatshrink 12/4'}
+
+
+def read_gcode(file) -> str:
+    with open(file, 'rb') as input:
+        return ''.join(lib_bgcode.BgcodeReader(input).gcode())
+
+
+def compare(name, expected, actual) -> bool:
+    if expected == actual:
+        print(f'{name}: OK')
+        return True
+    expected_lines = list(StringIO(expected, newline='\n'))
+    actual_lines = list(StringIO(actual, newline='\n'))
+    for (line, (e, a)) in enumerate(zip(expected_lines, actual_lines), 1):
+        if e != a:
+            print(f'{name}: FAILED at line {line}, expected {e!r}, got {a!r}')
+            return False
+    print(f'{name}: FAILED, expected {len(expected_lines)} lines, got {len(actual_lines)}')
+    return False
+
+
+def check_synthetic(size_mb) -> int:
+    failed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for slicer in synthetic.SLICERS:
+            source_file = path.join(directory, f'{slicer}.gcode')
+            synthetic.gcode(source_file, size_mb, slicer=slicer)
+            body = b''.join(synthetic.split_gcode(source_file)[4]).decode('utf8')
+            for (compression, compression_name) in COMPRESSIONS.items():
+                for meatpack in (False, True):
+                    output_file = path.join(directory, f'{slicer}-{compression}-{int(meatpack)}.bgcode')
+                    synthetic.bgcode(output_file, source_file, compression, meatpack)
+                    # Empty lines are not kept by MeatPack
+                    expected = re.sub('\n\n+', '\n', body) if meatpack else body
+                    if not compare(f'{slicer}, {compression_name}{", MeatPack" if meatpack else ""}', expected, read_gcode(output_file)):
+                        failed += 1
+    return failed
+
+
+def check_fixtures(files) -> int:
+    failed = 0
+    for file in files:
+        expected_file = path.splitext(file)[0] + '.gcode'
+        if not path.exists(expected_file):
+            print(f'{file}: FAILED, expected text g-code {expected_file} is missing')
+            failed += 1
+            continue
+        with open(expected_file, encoding='utf8', newline='') as input:
+            expected = input.read()
+        if not compare(file, expected, read_gcode(file)):
+            failed += 1
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Round-trip check of binary g-code reader')
+    parser.add_argument('--size', type=float, default=0.5, help='Size of synthetic g-code files in MB')
+    parser.add_argument('files', nargs='*', help='Binary g-code files with expected text g-code next to them')
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(path.join(FIXTURES, '*.bgcode')))
+    failed = check_synthetic(args.size)
+    if files:
+        failed += check_fixtures(files)
+    else:
+        print(f'No slicer fixtures found in {FIXTURES}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
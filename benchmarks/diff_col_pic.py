@@ -0,0 +1,216 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+"""
+Differential check of ColPic encoders: output of candidate encoder is compared with the reference one
+(frozen copy of the original encoder in col_pic_reference.py) byte by byte, then decoded back and compared
+with the source pixels. The reference is slow (up to seconds per image)
+
+    python benchmarks/diff_col_pic.py [--candidate module:function] [--count N] [--seed S] [--no-numpy] [files ...]
+
+Candidate is a function with ColPic_EncodeStr signature (fromcolor16, picw, pich, outputdata, outputmaxtsize, colorsmax),
+given as module:function or path/to/file.py:function. Default is lib_col_pic.ColPic_EncodeStr with numpy (when installed,
+--no-numpy checks the pure Python path). Besides random images, palettes of 1023, 1024 & 1025 colors are checked
+(the original encoder stops counting dots once 1024 colors are listed).
+Files are images or g-code files, their thumbnails are rendered the way thumbnail.py does it. Already converted
+g-code files also get their ;gimage:/;simage: lines decoded. Exit code is 1 when any check fails.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import random
+import sys
+
+from array import array
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import col_pic_reference
+import lib_col_pic
+import thumbnail
+
+from synthetic import gradient_image
+
+# Sizes used by printers plus a few odd ones
+SIZES = ((200, 200), (160, 160), (100, 100), (16, 16), (17, 31), (255, 3), (64, 300))
+
+
+def load_candidate(spec):
+    (module_name, function_name) = spec.rsplit(':', 1)
+    if module_name.endswith('.py'):
+        module_spec = importlib.util.spec_from_file_location(path.splitext(path.basename(module_name))[0], module_name)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+
+def encode(encoder, color16, width, height, colorsmax) -> bytes:
+    buffer_size = width * height * 10
+    buffer = bytearray(buffer_size)
+    # Copy, so encoder modifying its input does not affect the next one
+    qty = int(encoder(bytearray(color16), width, height, buffer, buffer_size, colorsmax))
+    return bytes(buffer[:qty])
+
+
+def reference_encoder(fromcolor16, picw, pich, outputdata, outputmaxtsize, colorsmax):
+    # The original encoder takes list of RGB565 values, it is converted here instead of lib_col_pic.Color16FromBytes
+    color16 = array('H')
+    color16.frombytes(fromcolor16)
+    if sys.byteorder == 'big':
+        color16.byteswap()
+    return col_pic_reference.ColPic_EncodeStr(color16.tolist(), picw, pich, outputdata, outputmaxtsize, colorsmax)
+
+
+def check(candidate, color16, width, height, colorsmax) -> list:
+    """
+    Problems found encoding the image with candidate encoder
+    """
+    problems = []
+    reference = encode(reference_encoder, color16, width, height, colorsmax)
+    try:
+        encoded = encode(candidate, color16, width, height, colorsmax)
+    except Exception as ex:
+        return [f'candidate failed: {ex!r}']
+
+    if encoded != reference:
+        pos = next((i for i, (a, b) in enumerate(zip(encoded, reference)) if a != b), min(len(encoded), len(reference)))
+        problems.append(f'output differs from reference at byte {pos} ({len(encoded)} bytes, {len(reference)} expected)')
+
+    try:
+        (picw, pich, pixels) = lib_col_pic.ColPic_DecodeStr(encoded)
+    except Exception as ex:
+        return problems + [f'decoding failed: {ex!r}']
+    if (picw, pich) != (width, height):
+        problems.append(f'decoded size {picw}x{pich}')
+
+    source = lib_col_pic.Color16FromBytes(color16)
+    if len(set(source)) <= min(colorsmax, 1024):
+        if pixels != source:
+            problems.append('decoded pixels differ from source')
+    else:
+        # Too many colors, so only the same quantization as reference is expected
+        if pixels != lib_col_pic.ColPic_DecodeStr(reference)[2]:
+            problems.append('decoded pixels differ from decoded reference')
+
+    lines = thumbnail.colpic_frame(encoded, ';gimage:')
+    if thumbnail.colpic_unframe(lines).get(';gimage:', '').encode('ascii') != encoded:
+        problems.append('framing round trip failed')
+    return problems
+
+
+def random_image(rnd, width, height, kind) -> bytes:
+    """
+    Little-endian RGB565 buffer: solid, runs of a few colors (long and short), uniform noise or noisy gradient
+    """
+    dotsqty = width * height
+    if kind == 'solid':
+        color16 = array('H', [rnd.randrange(65536)]) * dotsqty
+    elif kind == 'runs':
+        colors = [rnd.randrange(65536) for _ in range(rnd.choice((2, 31, 32, 33, 100, 1024, 1025, 2000)))]
+        color16 = array('H')
+        while len(color16) < dotsqty:
+            color16.extend([rnd.choice(colors)] * rnd.choice((1, 2, 6, 7, 254, 255, 256, 600)))
+        del color16[dotsqty:]
+    elif kind == 'noise':
+        color16 = array('H', (rnd.randrange(65536) for _ in range(dotsqty)))
+    else:
+        color16 = gradient_image(width, height, rnd.choice((0, 2, 6)), rnd)
+    if sys.byteorder == 'big':
+        color16.byteswap()
+    return color16.tobytes()
+
+
+def random_cases(count, seed):
+    rnd = random.Random(seed)
+    for index in range(count):
+        (width, height) = SIZES[index % len(SIZES)] if index < len(SIZES) * 2 else (rnd.randrange(16, 260), rnd.randrange(16, 260))
+        kind = ('solid', 'runs', 'noise', 'gradient')[index % 4]
+        colorsmax = rnd.choice((1024, 1024, 1024, 256, 32))
+        yield (f'random #{index} {kind} {width}x{height} colorsmax={colorsmax}', random_image(rnd, width, height, kind), width, height, colorsmax)
+
+
+def boundary_cases(seed):
+    """
+    Images with about 1024 colors: all colors are listed first, then the listed ones are repeated with varying
+    frequency, so counts (and palette order) depend on where the original encoder stops counting
+    """
+    rnd = random.Random(seed)
+    (width, height) = (64, 64)
+    for qty in (1023, 1024, 1025):
+        colors = rnd.sample(range(65536), qty)
+        color16 = array('H', colors)
+        while len(color16) < width * height:
+            color16.append(colors[min(int(rnd.expovariate(0.05)), qty - 1)])
+        if sys.byteorder == 'big':
+            color16.byteswap()
+        for colorsmax in (1024, 32):
+            yield (f'boundary {qty} colors colorsmax={colorsmax}', color16.tobytes(), width, height, colorsmax)
+
+
+def file_cases(file_name):
+    """
+    Images rendered from file (the way thumbnail.py does it), embedded ColPic images are checked right away
+    """
+    from PIL import Image
+
+    obj = thumbnail.Neptune_Thumbnail(file_name)
+    if path.splitext(file_name)[1].lower() == '.gcode':
+        with open(file_name, 'rb') as input:
+            first_line = input.readline().decode('ascii', errors='replace')
+        for (prefix, text) in thumbnail.colpic_unframe(first_line).items():
+            try:
+                (picw, pich, pixels) = lib_col_pic.ColPic_DecodeStr(text)
+                print(f'ok     {file_name} embedded {prefix} {picw}x{pich}')
+            except Exception as ex:
+                yield (f'{file_name} embedded {prefix}', ex)
+        obj.parse()
+        obj.prepare()
+        if obj.thumbnail is None:
+            return
+        img = obj.image_decode(obj.thumbnail_data(obj.thumbnail), obj.thumbnail.format)
+    else:
+        img = Image.open(file_name).convert('RGBA')
+
+    master = obj.image_composite(img, thumbnail.NEPTUNE_BACKGROUND)
+    for size in (200, 160):
+        rendered = obj.image_modify(obj.image_resize(master, size), background=thumbnail.NEPTUNE_BACKGROUND)
+        yield (f'{file_name} {rendered.width}x{rendered.height}', thumbnail.rgb565_le(rendered), rendered.width, rendered.height, 1024)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=path.basename(__file__))
+    parser.add_argument('files', nargs='*', help='Images or g-code files to check in addition to random images')
+    parser.add_argument('--candidate', default='lib_col_pic:ColPic_EncodeStr', help='Encoder to check (module:function or file.py:function)')
+    parser.add_argument('--count', type=int, default=100, help='Number of random images')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of random images')
+    parser.add_argument('--no-numpy', default=False, action='store_true', help='Check pure Python path of lib_col_pic')
+    args = parser.parse_args()
+
+    if not args.no_numpy:
+        lib_col_pic.enable_numpy()
+    candidate = load_candidate(args.candidate)
+    print(f'candidate: {args.candidate}, numpy: {lib_col_pic.np is not None}')
+
+    cases = list(random_cases(args.count, args.seed))
+    cases.extend(boundary_cases(args.seed))
+    for file_name in args.files:
+        cases.extend(file_cases(file_name))
+
+    failed = 0
+    for case in cases:
+        if len(case) == 2:
+            # Embedded image that failed to decode
+            (name, ex) = case
+            problems = [f'decoding failed: {ex!r}']
+        else:
+            (name, color16, width, height, colorsmax) = case
+            problems = check(candidate, color16, width, height, colorsmax)
+        if problems:
+            failed += 1
+            print(f'FAILED {name}: {"; ".join(problems)}')
+
+    print(f'{len(cases)} images checked, {failed} failed')
+    sys.exit(1 if failed else 0)
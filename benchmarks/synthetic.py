@@ -0,0 +1,289 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+"""
+Synthetic slicer-like g-code files for benchmarks
+"""
+
+import base64
+import random
+import struct
+import zlib
+
+from array import array
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageDraw
+
+SLICERS = ('prusa', 'orca')
+COMPLEXITIES = ('flat', 'shapes', 'noise')
+
+# Layer bodies are taken from a pool, so even 1 GB files are generated quickly
+LAYER_POOL_SIZE = 64
+LAYER_MOVES = 200
+
+
+def thumbnail(width, height, img_type='PNG', seed=0, complexity='shapes') -> bytes:
+    """
+    Model-like image over transparent background, encoded as PNG, JPG or QOI. Complexity defines number of colors:
+    flat -- a few solid shapes, shapes -- many overlapping shapes, noise -- gradients with per-pixel noise (thousands of colors)
+    """
+    rnd = random.Random(seed)
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    if complexity == 'flat':
+        for _ in range(4):
+            x = rnd.randrange(width // 2)
+            y = rnd.randrange(height // 2)
+            draw.rectangle([x, y, x + width // 3, y + height // 3], fill=(0, 150, 136, 255))
+            draw.ellipse([x + 2, y + 2, x + width // 4, y + height // 4], fill=(0, 105, 92, 255))
+    elif complexity == 'noise':
+        r = Image.linear_gradient('L').resize((width, height))
+        g = Image.radial_gradient('L').resize((width, height))
+        b = ImageChops.add(r.rotate(90), Image.effect_noise((width, height), 40), scale=2)
+        mask = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(mask).ellipse([width // 10, height // 10, width * 9 // 10, height * 9 // 10], fill=255)
+        img.paste(Image.merge('RGB', (r, g, b)), mask=mask)
+    else:
+        for _ in range(40):
+            x = rnd.randrange(width)
+            y = rnd.randrange(height)
+            draw.ellipse([x, y, x + rnd.randrange(1, max(2, width // 2)), y + rnd.randrange(1, max(2, height // 2))], fill=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), 255))
+    byte_buffer = BytesIO()
+    if img_type == 'JPG':
+        img.convert('RGB').save(byte_buffer, 'JPEG')
+    else:
+        img.save(byte_buffer, img_type)
+    return byte_buffer.getvalue()
+
+
+def gradient_image(width, height, noise, rnd=None) -> array:
+    """
+    RGB565 image with diagonal gradients plus random noise, similar to photographic slicer renders
+    """
+    if rnd is None:
+        rnd = random.Random(0)
+    color16 = array('H')
+    for i in range(height):
+        for j in range(width):
+            r = min(31, (j * 31 // width) + rnd.randrange(noise + 1))
+            g = min(63, ((i + j) * 63 // (width + height)) + rnd.randrange(noise + 1))
+            b = min(31, (i * 31 // height) + rnd.randrange(noise + 1))
+            color16.append((r << 11) | (g << 5) | b)
+    return color16
+
+
+def thumbnail_block(width, height, img_type='PNG', seed=0, complexity='shapes') -> str:
+    base64_str = base64.b64encode(thumbnail(width, height, img_type, seed, complexity)).decode('ascii')
+    tag = 'thumbnail' if img_type == 'PNG' else f'thumbnail_{img_type}'
+    result = f'; {tag} begin {width}x{height} {len(base64_str)}\n'
+    for pos in range(0, len(base64_str), 78):
+        result += f'; {base64_str[pos:pos+78]}\n'
+    result += f'; {tag} end\n;\n\n'
+    return result
+
+
+def layer_pool(rnd) -> list:
+    return [
+        ''.join(f'G1 X{rnd.uniform(10, 200):.3f} Y{rnd.uniform(10, 200):.3f} E{rnd.uniform(0, 1):.5f}\n' for _ in range(LAYER_MOVES))
+        for _ in range(LAYER_POOL_SIZE)
+    ]
+
+
+def gcode(output_file, size_mb=1, img_type='PNG', thumbnail_sizes=((16, 16), (300, 300)), seed=0, slicer='prusa', complexity='shapes'):
+    """
+    Write PrusaSlicer-like or OrcaSlicer-like g-code file of about size_mb megabytes
+    """
+    rnd = random.Random(seed)
+    pool = layer_pool(rnd)
+    layers = max(1, int(size_mb * 1024 * 1024) // len(pool[0]))
+    thumbnails = ''.join(thumbnail_block(width, height, img_type, seed, complexity) for (width, height) in thumbnail_sizes)
+    with open(output_file, 'w', encoding='utf8', newline='\n') as output:
+        if slicer == 'orca':
+            output.write('; HEADER_BLOCK_START\n; generated by OrcaSlicer 1.9.0 on 2024-01-01 at 10:00:00\n')
+            output.write(f'; total layer number: {layers}\n; filament_density: 1.24\n; filament_diameter: 1.75\n; max_z_height: {layers * 0.2:.2f}\n; HEADER_BLOCK_END\n\n')
+            output.write(f'; THUMBNAIL_BLOCK_START\n{thumbnails}; THUMBNAIL_BLOCK_END\n\n')
+            output.write('; external perimeters extrusion width = 0.45mm\n\nM73 P0 R95\nM201 X1000 Y1000 Z200 E5000\n')
+        else:
+            output.write('; generated by PrusaSlicer 2.7.1+win64 on 2024-01-01 at 10:00:00 UTC\n\n;\n\n')
+            output.write(thumbnails)
+            output.write('; external perimeters extrusion width = 0.45mm\n\nM73 P0 R95\nM201 X1000 Y1000 Z200 E5000\n')
+            output.write('G28 W ; home all without mesh bed level\nG1 Z0.2 F720 ; lift nozzle to Z 0.2\nG92 E0 ;reset extruder\n')
+            # Custom g-code comments can have characters str.splitlines() takes as line breaks
+            output.write('; printer notes: page\x0cbreak, tab\x0b, separators \x1c\x1d\x1e\u0085\u2028 of one line\n')
+
+        for layer in range(1, layers + 1):
+            if slicer == 'orca':
+                output.write(f';LAYER_CHANGE\n;Z:{layer * 0.2:.1f}\n;HEIGHT:0.2\n; CHANGE_LAYER\n; Z_HEIGHT: {layer * 0.2:.1f}\n; LAYER_HEIGHT: 0.2\nM73 L{layer}\nG1 Z{layer * 0.2:.3f} F720\n')
+            else:
+                output.write(f';LAYER_CHANGE\n;Z:{layer * 0.2:.1f}\n;HEIGHT:0.2\nG1 Z{layer * 0.2:.3f} F720\n')
+            output.write(pool[layer % len(pool)])
+            output.write(f'M73 P{(layer - 1) * 100 // layers} R{95 - (layer - 1) * 95 // layers}\n')
+
+        output.write('M73 P100 R0\nM107\n')
+        if slicer == 'orca':
+            output.write('; EXECUTABLE_BLOCK_END\n\n; filament used [mm] = 1234.56\n; filament used [cm3] = 2.97\n; filament used [g] = 3.68\n; total filament used [g] = 3.68\n; filament cost = 0.09\n; total filament cost = 0.09\n')
+            output.write(f'; total layers count = {layers}\n; estimated printing time (normal mode) = 1h 35m 12s\n\n; CONFIG_BLOCK_START\n; print_sequence = by layer\n; printable_height = 250\n; CONFIG_BLOCK_END\n')
+        else:
+            output.write('; filament used [mm] = 1234.56\n; filament used [cm3] = 2.97\n; total filament used [g] = 3.68\n; total filament cost = 0.09\n; estimated printing time (normal mode) = 1h 35m 12s\n')
+            output.write('\n; prusaslicer_config = begin\n; max_print_height = 250\n; prusaslicer_config = end\n')
+
+
+# Binary g-code as PrusaSlicer writes it by default: metadata & thumbnails uncompressed (slicer config deflated),
+# g-code blocks of 64 KB with MeatPack (no-spaces mode, comments kept) compressed by heatshrink 12/4
+BGCODE_BLOCK_SIZE = 64 * 1024
+MEATPACK_CODES = {c: i for (i, c) in enumerate(b'0123456789. \nGX')}
+MEATPACK_CODES_NO_SPACES = {c: i for (i, c) in enumerate(b'0123456789.E\nGX')}
+
+
+def heatshrink_compress(data, window_bits=12, lookahead_bits=4) -> bytes:
+    """
+    Greedy heatshrink encoder (matches of 3+ bytes are found by the last position of their first 3 bytes)
+    """
+    window = 1 << window_bits
+    max_count = 1 << lookahead_bits
+    result = bytearray()
+    acc = 0
+    acc_bits = 0
+    last = {}
+    pos = 0
+    size = len(data)
+    while pos < size:
+        key = data[pos:pos + 3]
+        candidate = last.get(key)
+        last[key] = pos
+        count = 0
+        if candidate is not None and pos - candidate <= window:
+            limit = min(max_count, size - pos)
+            while count < limit and data[candidate + count] == data[pos + count]:
+                count += 1
+        if count >= 3:
+            (value, bits) = (((pos - candidate - 1) << lookahead_bits) | (count - 1), 1 + window_bits + lookahead_bits)
+            for p in range(pos + 1, pos + count):
+                last[data[p:p + 3]] = p
+            pos += count
+        else:
+            (value, bits) = (0x100 | data[pos], 9)
+            pos += 1
+        acc = (acc << bits) | value
+        acc_bits += bits
+        while acc_bits >= 8:
+            acc_bits -= 8
+            result.append((acc >> acc_bits) & 0xFF)
+        acc &= (1 << acc_bits) - 1
+    if acc_bits:
+        result.append((acc << (8 - acc_bits)) & 0xFF)
+    return bytes(result)
+
+
+def meatpack_encode(text, no_spaces=True) -> bytes:
+    """
+    MeatPack g-code (spaces are removed from G lines in no-spaces mode, comments & spaces before them are kept)
+    """
+    codes = MEATPACK_CODES_NO_SPACES if no_spaces else MEATPACK_CODES
+    result = bytearray(b'\xff\xff\xfb' + (b'\xff\xff\xf7' if no_spaces else b''))
+    for line in BytesIO(text):
+        if no_spaces and line[:1] == b'G' and line[1:2].isdigit():
+            (code, semicolon, comment) = line.partition(b';')
+            if semicolon:
+                line = code.rstrip(b' ').replace(b' ', b'') + code[len(code.rstrip(b' ')):] + semicolon + comment
+            else:
+                line = line.replace(b' ', b'')
+        for pos in range(0, len(line), 2):
+            pair = line[pos:pos + 2]
+            first = codes.get(pair[0], 0x0F)
+            if first == 0x0C or len(pair) == 1:
+                result.append(first)
+                if first == 0x0F:
+                    result.append(pair[0])
+                continue
+            second = codes.get(pair[1], 0x0F)
+            result.append(first | (second << 4))
+            result += bytes(c for (c, code) in zip(pair, (first, second)) if code == 0x0F)
+    return bytes(result)
+
+
+def bgcode_block(block_type, params, data, compression=0) -> bytes:
+    if compression == 1:
+        payload = zlib.compress(data)
+    elif compression in (2, 3):
+        payload = heatshrink_compress(data, 11 if compression == 2 else 12, 4)
+    else:
+        payload = data
+    header = struct.pack('<HHI', block_type, compression, len(data))
+    if compression:
+        header += struct.pack('<I', len(payload))
+    header += params
+    return header + payload + struct.pack('<I', zlib.crc32(payload, zlib.crc32(header)))
+
+
+def split_gcode(source_file) -> tuple:
+    """
+    Split text g-code file (written by gcode()) into parts of binary g-code: (producer, thumbnails, summary, config,
+    body lines, max_layer_z)
+    """
+    with open(source_file, 'rb') as input:
+        lines = input.readlines()
+
+    producer = None
+    thumbnails = []
+    summary = []
+    config = []
+    body = []
+    max_layer_z = 0.0
+    thumbnail = None
+    in_config = False
+    for line in lines:
+        text = line.decode('utf8').strip()
+        if text.startswith('; generated by '):
+            producer = text[len('; generated by '):].split(' on ')[0]
+        elif text.startswith('; thumbnail') and ' begin ' in text:
+            (size, _) = text.split(' begin ')[1].split(' ')
+            thumbnail = (text[len('; thumbnail'):].split(' ')[0].strip('_') or 'PNG', size, [])
+        elif thumbnail is not None:
+            if text.endswith(' end'):
+                thumbnails.append(thumbnail)
+                thumbnail = None
+            else:
+                thumbnail[2].append(text.strip('; '))
+        elif text in ('; prusaslicer_config = begin', '; CONFIG_BLOCK_START'):
+            in_config = True
+        elif text in ('; prusaslicer_config = end', '; CONFIG_BLOCK_END'):
+            in_config = False
+        elif in_config and ' = ' in text:
+            config.append(text[2:])
+        elif text.startswith('; ') and ' = ' in text and ('filament' in text or 'printing time' in text or 'layers count' in text):
+            summary.append(text[2:])
+        else:
+            if text.startswith(';Z:'):
+                max_layer_z = max(max_layer_z, float(text[3:]))
+            body.append(line)
+    return (producer, thumbnails, summary, config, body, max_layer_z)
+
+
+def bgcode(output_file, source_file, compression=3, meatpack=True):
+    """
+    Convert text g-code file (written by gcode()) into binary g-code
+    """
+    (producer, thumbnails, summary, config, body, max_layer_z) = split_gcode(source_file)
+
+    def metadata(items) -> bytes:
+        return ''.join(f'{key.strip()}={value.strip()}\n' for (key, _, value) in (item.partition('=') for item in items)).encode('utf8')
+
+    with open(output_file, 'wb') as output:
+        output.write(struct.pack('<4sIH', b'GCDE', 1, 1))
+        output.write(bgcode_block(0, struct.pack('<H', 0), metadata([f'Producer={producer}'])))
+        output.write(bgcode_block(3, struct.pack('<H', 0), metadata(summary + [f'max_layer_z={max_layer_z:.2f}'])))
+        for (img_type, size, text) in thumbnails:
+            (width, height) = (int(v) for v in size.split('x'))
+            output.write(bgcode_block(5, struct.pack('<HHH', ('PNG', 'JPG', 'QOI').index(img_type), width, height), base64.b64decode(''.join(text))))
+        output.write(bgcode_block(4, struct.pack('<H', 0), metadata(summary)))
+        output.write(bgcode_block(2, struct.pack('<H', 0), metadata(config), 1))
+        block = b''
+        for line in body + [b'']:
+            if line and len(block) + len(line) <= BGCODE_BLOCK_SIZE:
+                block += line
+                continue
+            if block:
+                data = meatpack_encode(block) if meatpack else block
+                output.write(bgcode_block(1, struct.pack('<H', 2 if meatpack else 0), data, compression))
+            block = line
@@ -8,7 +8,7 @@ added_files = [
 ]
 
 a = Analysis(
-    ['thumbnail.py', 'lib_col_pic.py'],
+    ['thumbnail.py', 'lib_col_pic.py', 'lib_gcode.py', 'lib_watch.py', 'lib_startup.py', 'lib_cache.py', 'lib_metrics.py', 'lib_bgcode.py', 'lib_compress.py', 'lib_qoi.py'],
     pathex=[],
     binaries=[],
     datas=added_files,
@@ -0,0 +1,333 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+import re
+import struct
+import zlib
+
+from io import StringIO
+from os import fstat
+
+# Binary g-code (.bgcode) as exported by PrusaSlicer, see https://github.com/prusa3d/libbgcode/blob/main/doc/specifications.md
+
+MAGIC = b'GCDE'
+FILE_HEADER = struct.Struct('<4sIH')
+BLOCK_HEADER = struct.Struct('<HHI')
+COMPRESSED_SIZE = struct.Struct('<I')
+ENCODING_PARAMS = struct.Struct('<H')
+THUMBNAIL_PARAMS = struct.Struct('<HHH')
+
+# Block types
+FILE_METADATA = 0
+GCODE = 1
+SLICER_METADATA = 2
+PRINTER_METADATA = 3
+PRINT_METADATA = 4
+THUMBNAIL = 5
+
+# Compression types
+COMPRESSION_NONE = 0
+COMPRESSION_DEFLATE = 1
+COMPRESSION_HEATSHRINK_11_4 = 2
+COMPRESSION_HEATSHRINK_12_4 = 3
+
+# G-code block encodings
+ENCODING_NONE = 0
+ENCODING_MEATPACK = 1
+ENCODING_MEATPACK_COMMENTS = 2
+
+THUMBNAIL_FORMATS = ('PNG', 'JPG', 'QOI')
+
+# Checksum size by checksum type: none & CRC32
+CHECKSUM_SIZES = {0: 0, 1: 4}
+
+
+class Block:
+    """
+    Block header, data is read only when needed so blocks that are not needed are skipped by seeking
+    """
+    def __init__(self, offset, header, type, compression, uncompressed_size, compressed_size, params):
+        self.offset = offset
+        self.header = header
+        self.type = type
+        self.compression = compression
+        self.uncompressed_size = uncompressed_size
+        self.compressed_size = compressed_size
+        # (encoding,) or (format, width, height) for thumbnails
+        self.params = params
+        self.data_offset = offset + len(header)
+
+
+class BgcodeReader:
+    """
+    Blocks of binary g-code file opened in binary mode
+    """
+    def __init__(self, input):
+        self.input = input
+        self.size = fstat(input.fileno()).st_size
+        header = input.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or header[:4] != MAGIC:
+            raise Exception('Not a binary g-code file')
+        (_, self.version, checksum_type) = FILE_HEADER.unpack(header)
+        if self.version != 1:
+            raise Exception(f'Unsupported binary g-code version {self.version}')
+        if checksum_type not in CHECKSUM_SIZES:
+            raise Exception(f'Unsupported binary g-code checksum type {checksum_type}')
+        self.checksum_type = checksum_type
+        self.checksum_size = CHECKSUM_SIZES[checksum_type]
+
+
+    def blocks(self, offset=FILE_HEADER.size):
+        """
+        Yield headers of blocks starting at offset (the first block by default)
+        """
+        while offset < self.size:
+            self.input.seek(offset)
+            header = self.input.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                raise Exception(f'Truncated block header at offset {offset}')
+            (type, compression, uncompressed_size) = BLOCK_HEADER.unpack(header)
+            compressed_size = uncompressed_size
+            if compression != COMPRESSION_NONE:
+                raw = self.input.read(COMPRESSED_SIZE.size)
+                header += raw
+                if len(raw) < COMPRESSED_SIZE.size:
+                    raise Exception(f'Truncated block header at offset {offset}')
+                (compressed_size,) = COMPRESSED_SIZE.unpack(raw)
+            params_struct = THUMBNAIL_PARAMS if type == THUMBNAIL else ENCODING_PARAMS
+            raw = self.input.read(params_struct.size)
+            header += raw
+            if len(raw) < params_struct.size:
+                raise Exception(f'Truncated block parameters at offset {offset}')
+            block = Block(offset, header, type, compression, uncompressed_size, compressed_size, params_struct.unpack(raw))
+            yield block
+            offset = block.data_offset + compressed_size + self.checksum_size
+        if offset > self.size:
+            raise Exception(f'Truncated block at the end of file')
+
+
+    def read(self, block) -> bytes:
+        """
+        Decompressed block data (g-code is still MeatPack encoded), checksum is verified
+        """
+        self.input.seek(block.data_offset)
+        data = self.input.read(block.compressed_size + self.checksum_size)
+        if len(data) < block.compressed_size + self.checksum_size:
+            raise Exception(f'Truncated block at offset {block.offset}')
+        if self.checksum_size:
+            (checksum,) = struct.unpack('<I', data[-4:])
+            data = data[:-4]
+            if zlib.crc32(data, zlib.crc32(block.header)) != checksum:
+                raise Exception(f'Checksum mismatch of block at offset {block.offset}')
+        return decompress(data, block.compression, block.uncompressed_size)
+
+
+    def gcode(self, offset=FILE_HEADER.size):
+        """
+        Yield text g-code lines of all g-code blocks starting at offset
+        """
+        rest = b''
+        for block in self.blocks(offset):
+            if block.type != GCODE:
+                continue
+            data = self.read(block)
+            (encoding,) = block.params
+            if encoding in (ENCODING_MEATPACK, ENCODING_MEATPACK_COMMENTS):
+                data = meatpack_decode(data)
+            elif encoding != ENCODING_NONE:
+                raise Exception(f'Unsupported g-code encoding {encoding}')
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            rest = data[end:]
+            if end:
+                # Lines are split on '\n' only (str.splitlines() also splits on form feed & other characters of comments)
+                yield from StringIO(data[:end].decode('utf8'), newline='\n')
+        if rest:
+            yield rest.decode('utf8')
+
+
+def decompress(data, compression, size) -> bytes:
+    if compression == COMPRESSION_NONE:
+        result = data
+    elif compression == COMPRESSION_DEFLATE:
+        result = zlib.decompress(data)
+    elif compression == COMPRESSION_HEATSHRINK_11_4:
+        result = heatshrink_decompress(data, 11, 4, size)
+    elif compression == COMPRESSION_HEATSHRINK_12_4:
+        result = heatshrink_decompress(data, 12, 4, size)
+    else:
+        raise Exception(f'Unsupported compression {compression}')
+    if len(result) != size:
+        raise Exception(f'Block decompressed into {len(result)} bytes, {size} expected')
+    return bytes(result)
+
+
+def parse_metadata(data) -> dict:
+    """
+    Metadata block (INI encoding) as dict
+    """
+    result = {}
+    for line in data.decode('utf8').split('\n'):
+        (key, sep, value) = line.partition('=')
+        if sep:
+            result[key.strip()] = value.strip()
+    return result
+
+
+def heatshrink_decompress(data, window_bits, lookahead_bits, size) -> bytearray:
+    """
+    Decompress heatshrink (LZSS) stream: bit 1 + 8 bits literal byte, bit 0 + window_bits index + lookahead_bits count backreference
+    """
+    result = bytearray()
+    total_bits = len(data) * 8
+    # Padding, so 4 bytes can always be taken
+    data = bytes(data) + b'\0\0\0\0'
+    backref_bits = window_bits + lookahead_bits
+    backref_shift = 31 - backref_bits
+    backref_mask = (1 << backref_bits) - 1
+    count_mask = (1 << lookahead_bits) - 1
+    from_bytes = int.from_bytes
+    append = result.append
+    pos = 0
+    length = 0
+    while length < size:
+        # 32 bits starting at the current bit
+        bits = from_bytes(data[pos >> 3:(pos >> 3) + 4], 'big') << (pos & 7)
+        if bits & 0x80000000:
+            if pos + 9 > total_bits:
+                break
+            append((bits >> 23) & 0xFF)
+            pos += 9
+            length += 1
+        else:
+            pos += 1 + backref_bits
+            if pos > total_bits:
+                break
+            value = (bits >> backref_shift) & backref_mask
+            offset = (value >> lookahead_bits) + 1
+            count = (value & count_mask) + 1
+            start = length - offset
+            if start < 0 or count > offset:
+                # Window is initially filled with zeros, overlapping copy repeats the last offset bytes
+                window = bytes(max(0, -start)) + result[max(0, start):]
+                result += (window * (count // offset + 1))[:count]
+            else:
+                result += result[start:start + count]
+            length += count
+    return result
+
+
+# MeatPack packs two characters of the table into one byte (the first one in the lower 4 bits), 0b1111 means
+# the character is not packed and follows as a full byte. 0xFF 0xFF <command> switches packing & no-spaces mode.
+MEATPACK_CHARS = b'0123456789. \nGX'
+MEATPACK_CHARS_NO_SPACES = b'0123456789.E\nGX'
+MEATPACK_ENABLE_PACKING = 0xFB
+MEATPACK_DISABLE_PACKING = 0xFA
+MEATPACK_RESET_ALL = 0xF9
+MEATPACK_ENABLE_NO_SPACES = 0xF7
+MEATPACK_DISABLE_NO_SPACES = 0xF6
+# Packed bytes are expanded into the first character (or MEATPACK_FULL when it is not packed) and code of the second one
+# (MEATPACK_PADDING codes after line break, the rest of byte is padding then)
+MEATPACK_FULL = 0x01
+MEATPACK_SECOND = 0x10
+MEATPACK_PADDING = 0x80
+# Spaces are removed from G lines in no-spaces mode, they are added back before parameters as libbgcode does
+MEATPACK_PARAMETERS = (b'X', b'Y', b'Z', b'E', b'F', b'I', b'J', b'R', b'P', b'W', b'H', b'C', b'A')
+
+meatpack_command_regex = re.compile(rb'\xff\xff(.)', re.S)
+meatpack_glines_regex = re.compile(rb'^(?:G[^\n]*\n)+', re.M)
+meatpack_empty_lines_regex = re.compile(rb'\n\n+')
+
+
+class MeatPackTables:
+    """
+    Decoding tables of one packing mode. Every byte is expanded into two at once (the first character & the second code),
+    full characters (expanded the same way) are put back in place of the expanded pairs marking them, the second codes
+    between them are translated into characters at the end
+    """
+    def __init__(self, chars):
+        newline = chars.index(b'\n')
+        self.first = bytes(chars[b & 0x0F] if b & 0x0F != 0x0F else MEATPACK_FULL for b in range(256))
+        self.second = bytes((MEATPACK_PADDING if b & 0x0F == newline else MEATPACK_SECOND) | (b >> 4) for b in range(256))
+        codes = bytearray(range(256))
+        codes[MEATPACK_SECOND:MEATPACK_SECOND + 15] = chars[:15]
+        self.codes = bytes(codes)
+        self.padding = bytes(range(MEATPACK_PADDING, MEATPACK_PADDING + 16))
+        self.full = {bytes((self.first[b], self.second[b])): b for b in range(256)}
+        # Expanded pairs with full character(s) following: the first character full (the second one is a code),
+        # the second one full (the first character is kept) & both full (not in the table as there are too many)
+        self.escapes = {}
+        for (pair, c) in self.full.items():
+            for code in range(MEATPACK_SECOND, MEATPACK_SECOND + 15):
+                self.escapes[bytes((MEATPACK_FULL, code)) + pair] = bytes((c, self.codes[code]))
+            self.escapes[b'\x1f' + pair] = bytes((c,))
+        first_chars = b''.join(re.escape(bytes((c,))) for c in chars[:15] if c != ord('\n'))
+        self.escape_regex = re.compile(rb'(\x01\x1f....|\x01[\x10-\x1e]..|\x1f(?<=[' + first_chars + rb']\x1f)..)', re.S)
+
+
+    def escape(self, expanded) -> bytes:
+        return self.escapes.get(expanded) or bytes((self.full[expanded[2:4]], self.full[expanded[4:6]]))
+
+
+    def decode(self, data) -> bytes:
+        expanded = bytearray(len(data) * 2)
+        expanded[0::2] = data.translate(self.first)
+        expanded[1::2] = data.translate(self.second)
+        # Full characters can be any byte (codes too), so only the parts between them are translated
+        parts = self.escape_regex.split(expanded)
+        parts[0::2] = [part.translate(self.codes, self.padding) for part in parts[0::2]]
+        parts[1::2] = [self.escape(part) for part in parts[1::2]]
+        return b''.join(parts)
+
+
+# Created when the mode is used for the first time
+meatpack_tables = {}
+
+
+def meatpack_add_spaces(code) -> bytes:
+    for parameter in MEATPACK_PARAMETERS:
+        code = code.replace(parameter, b' ' + parameter)
+    return code
+
+
+def meatpack_spaces(m) -> bytes:
+    lines = m.group()
+    if b';' not in lines:
+        return meatpack_add_spaces(lines)
+    # Comment text is kept as it is, only the code before ';' is spaced
+    result = []
+    for line in lines.split(b'\n'):
+        (code, semicolon, comment) = line.partition(b';')
+        result.append(meatpack_add_spaces(code) + semicolon + comment)
+    return b'\n'.join(result)
+
+
+def meatpack_decode(data) -> bytes:
+    """
+    Decode MeatPack encoded g-code block
+    """
+    packing = False
+    no_spaces = False
+    no_spaces_used = False
+    pieces = []
+    for (index, part) in enumerate(meatpack_command_regex.split(data)):
+        if index % 2:
+            command = part[0]
+            if command == MEATPACK_ENABLE_PACKING:
+                packing = True
+            elif command in (MEATPACK_DISABLE_PACKING, MEATPACK_RESET_ALL):
+                packing = False
+            elif command == MEATPACK_ENABLE_NO_SPACES:
+                no_spaces = no_spaces_used = True
+            elif command == MEATPACK_DISABLE_NO_SPACES:
+                no_spaces = False
+        elif packing:
+            if no_spaces not in meatpack_tables:
+                meatpack_tables[no_spaces] = MeatPackTables(MEATPACK_CHARS_NO_SPACES if no_spaces else MEATPACK_CHARS)
+            pieces.append(meatpack_tables[no_spaces].decode(part))
+        else:
+            pieces.append(part)
+    result = b''.join(pieces)
+    if no_spaces_used:
+        result = meatpack_glines_regex.sub(meatpack_spaces, result)
+    # Empty lines are not kept by MeatPack
+    return meatpack_empty_lines_regex.sub(b'\n', result)
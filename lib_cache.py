@@ -0,0 +1,175 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from os import path
+
+logger = logging.getLogger(__name__)
+
+# Change when encoders or texts drawing change, so entries created by older versions are not used
+CACHE_VERSION = 1
+TEMP_PREFIX = '.tmp-'
+# Temporary files of crashed writers are removed after that many seconds
+TEMP_MAX_AGE = 3600
+
+
+def cache_key(data: bytes, *parts) -> str:
+    """
+    Hash of data and the parameters it is rendered with
+    """
+    h = hashlib.sha256()
+    h.update(repr((CACHE_VERSION,) + parts).encode('utf8'))
+    h.update(data)
+    return h.hexdigest()
+
+
+class BlockCache:
+    """
+    Persistent cache of encoded image blocks: one file per entry, least recently used entries are removed
+    when total size exceeds max_size. Entries are written into temporary file and renamed, so several
+    processes can share the cache
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+
+    def open_entry(self, key):
+        """
+        Cached text as opened file (so big entries are copied, not read into memory) or None
+        """
+        file_name = path.join(self.directory, key)
+        try:
+            input = open(file_name, 'r', encoding='utf8', newline='')
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            # mtime is the last use time for LRU
+            os.utime(file_name)
+        except OSError:
+            pass
+        self.hits += 1
+        return input
+
+
+    def writer(self, key):
+        """
+        Entry written piece by piece in with block
+        """
+        return EntryWriter(self, key)
+
+
+    def put(self, key, text):
+        """
+        Store text, errors are logged only as the cache is not vital
+        """
+        with self.writer(key) as entry:
+            entry.write(text)
+
+
+    def evict(self):
+        """
+        Remove least recently used entries till total size fits max_size
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.startswith(TEMP_PREFIX):
+                    if now - st.st_mtime > TEMP_MAX_AGE:
+                        self.remove(entry.path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for (mtime, size, file_name) in entries:
+            if total <= self.max_size:
+                break
+            self.remove(file_name)
+            total -= size
+
+
+    def remove(self, file_name):
+        try:
+            os.remove(file_name)
+        except OSError:
+            # Removed by other process or still opened on Windows
+            pass
+
+
+class EntryWriter:
+    """
+    Cache entry written piece by piece into temporary file, which is renamed into place when with block completes without
+    exception. Errors are logged only, the entry is just not stored then
+    """
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.output = None
+        self.temp_name = None
+
+
+    def __enter__(self):
+        try:
+            (fd, self.temp_name) = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.cache.directory)
+            self.output = open(fd, 'w', encoding='utf8', newline='')
+        except OSError:
+            logger.exception(f'Failed to write cache entry {self.key}')
+            self.discard()
+        return self
+
+
+    def write(self, text):
+        if self.output is None:
+            return
+        try:
+            self.output.write(text)
+        except OSError:
+            logger.exception(f'Failed to write cache entry {self.key}')
+            self.discard()
+
+
+    def discard(self):
+        if self.output is not None:
+            try:
+                self.output.close()
+            except OSError:
+                pass
+            self.output = None
+        if self.temp_name is not None:
+            self.cache.remove(self.temp_name)
+            self.temp_name = None
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.output is None:
+            return False
+        if exc_type is not None:
+            self.discard()
+            return False
+        try:
+            self.output.close()
+            self.output = None
+            os.replace(self.temp_name, path.join(self.cache.directory, self.key))
+            self.temp_name = None
+            self.cache.evict()
+        except OSError:
+            logger.exception(f'Failed to write cache entry {self.key}')
+            self.discard()
+        return False
@@ -1,12 +1,43 @@
 # Copyright (c) 2023 - 2024 Molodos
 # The ElegooNeptuneThumbnails plugin is released under the terms of the AGPLv3 or higher.
 
+import base64
+import sys
+
+from array import array
+from collections import Counter
+from itertools import groupby
+
+# numpy is imported by enable_numpy() only: the import takes longer than the vectorized encoding saves on one file
+np = None
+
+
+# base64 alphabet -> ColPic 6-bit alphabet (value + 48, '\\' replaced by '~')
+ColPicStrTable = bytes.maketrans(
+    b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/',
+    bytes(126 if i + 48 == 92 else i + 48 for i in range(64))
+)
+ColPicStrTableReverse = bytes.maketrans(
+    bytes(126 if i + 48 == 92 else i + 48 for i in range(64)),
+    b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+)
+
+
+def enable_numpy():
+    """
+    Use numpy (when installed) for palette, quantization & run encoding, returns True when it is used
+    """
+    global np
+    if np is None:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+    return np is not None
+
+
 def ColPic_EncodeStr(fromcolor16, picw, pich, outputdata: bytearray, outputmaxtsize, colorsmax):
-    qty = 0
-    temp = 0
-    strindex = 0
-    hexindex = 0
-    TempBytes = bytearray(4)
     qty = ColPicEncode(fromcolor16, picw, pich, outputdata, outputmaxtsize, colorsmax)
     if qty == 0:
         return 0
@@ -18,94 +49,44 @@ def ColPic_EncodeStr(fromcolor16, picw, pich, outputdata: bytearray, outputmaxts
 
     if qty * 4 / 3 >= outputmaxtsize:
         return 0
-    hexindex = qty
-    strindex = qty * 4 / 3
-    while hexindex > 0:
-        hexindex -= 3
-        strindex -= 4
-        TempBytes[0] = outputdata[hexindex] >> 2
-        TempBytes[1] = outputdata[hexindex] & 3
-        TempBytes[1] <<= 4
-        TempBytes[1] += outputdata[hexindex + 1] >> 4
-        TempBytes[2] = outputdata[hexindex + 1] & 15
-        TempBytes[2] <<= 2
-        TempBytes[2] += outputdata[hexindex + 2] >> 6
-        TempBytes[3] = outputdata[hexindex + 2] & 63
-        TempBytes[0] += 48
-        if chr(TempBytes[0]) == '\\':
-            TempBytes[0] = 126
-        TempBytes[1] += 48
-        if chr(TempBytes[1]) == '\\':
-            TempBytes[1] = 126
-        TempBytes[2] += 48
-        if chr(TempBytes[2]) == '\\':
-            TempBytes[2] = 126
-        TempBytes[3] += 48
-        if chr(TempBytes[3]) == '\\':
-            TempBytes[3] = 126
-        outputdata[int(strindex)] = TempBytes[0]
-        outputdata[int(strindex) + 1] = TempBytes[1]
-        outputdata[int(strindex) + 2] = TempBytes[2]
-        outputdata[int(strindex) + 3] = TempBytes[3]
-
-    qty = qty * 4 / 3
-    outputdata[int(qty)] = 0
+    packed = ColPicPackStr(outputdata[:qty])
+    qty = len(packed)
+    outputdata[:qty] = packed
+    outputdata[qty] = 0
     return qty
 
 
+# Every 3 bytes are split into four 6-bit values, which is exactly what base64 does
+def ColPicPackStr(data):
+    return base64.b64encode(data).translate(ColPicStrTable)
+
+
+def ColPicUnpackStr(data):
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    return base64.b64decode(bytes(data).translate(ColPicStrTableReverse), validate=True)
+
+
 def ColPicEncode(fromcolor16, picw, pich, outputdata: bytearray, outputmaxtsize, colorsmax):
-    l0 = U16HEAD()
     Head0 = ColPicHead3()
-    Listu16 = []
-    for i in range(1024):
-        Listu16.append(U16HEAD())
 
-    ListQty = 0
     enqty = 0
     dotsqty = picw * pich
+    if isinstance(fromcolor16, (bytes, bytearray, memoryview)):
+        fromcolor16 = Color16FromBytes(fromcolor16)
+    elif not isinstance(fromcolor16, array) or fromcolor16.typecode != 'H':
+        # Palette reduction remaps dots in place, numpy can only write into a buffer (a list would be copied)
+        fromcolor16 = array('H', fromcolor16)
     if colorsmax > 1024:
         colorsmax = 1024
-    for i in range(dotsqty):
-        ListQty = ADList0(fromcolor16[i], Listu16, ListQty, 1024)
-
-    for index in range(1, ListQty):
-        l0 = Listu16[index]
-        for i in range(index):
-            if l0.qty >= Listu16[i].qty:
-                aListu16 = bListu16 = Listu16.copy()
-                for j in range(index - i):
-                    Listu16[i + j + 1] = aListu16[i + j]
-
-                Listu16[i] = l0
-                break
-
-    while ListQty > colorsmax:
-        l0 = Listu16[ListQty - 1]
-        minval = 255
-        fid = -1
-        for i in range(colorsmax):
-            cha0 = Listu16[i].A0 - l0.A0
-            if cha0 < 0:
-                cha0 = 0 - cha0
-            cha1 = Listu16[i].A1 - l0.A1
-            if cha1 < 0:
-                cha1 = 0 - cha1
-            cha2 = Listu16[i].A2 - l0.A2
-            if cha2 < 0:
-                cha2 = 0 - cha2
-            chall = cha0 + cha1 + cha2
-            if chall < minval:
-                minval = chall
-                fid = i
-
-        for i in range(dotsqty):
-            if fromcolor16[i] == l0.colo16:
-                fromcolor16[i] = Listu16[fid].colo16
-
-        ListQty = ListQty - 1
-
-    for n in range(len(outputdata)):
-        outputdata[n] = 0
+    Listu16 = ColPicPalette(fromcolor16, dotsqty, 1024)
+    ListQty = len(Listu16)
+
+    if ListQty > colorsmax:
+        ColPicQuantize(fromcolor16, dotsqty, Listu16[:colorsmax], Listu16[colorsmax:ListQty])
+        ListQty = colorsmax
+
+    outputdata[:] = bytes(len(outputdata))
 
     Head0.encodever = 3
     Head0.oncelistqty = 0
@@ -146,98 +127,214 @@ def ColPicEncode(fromcolor16, picw, pich, outputdata: bytearray, outputmaxtsize,
     return sizeofColPicHead3 + Head0.ListDataSize + Head0.ColorDataSize
 
 
-def ADList0(val, Listu16, ListQty, maxqty):
-    qty = ListQty
-    if qty >= maxqty:
-        return ListQty
-    for i in range(qty):
-        if Listu16[i].colo16 == val:
-            Listu16[i].qty += 1
-            return ListQty
+# Accepts little-endian RGB565 buffer (bytes, bytearray, memoryview)
+def Color16FromBytes(data):
+    fromcolor16 = array('H')
+    fromcolor16.frombytes(data)
+    if sys.byteorder == 'big':
+        fromcolor16.byteswap()
+    return fromcolor16
+
+
+# Palette sorted by frequency, same result as the original per-dot list building followed by the insertion sort
+def ColPicPalette(fromcolor16, dotsqty, maxqty):
+    if np is not None:
+        colors, counts = PaletteHistogramNp(fromcolor16, dotsqty, maxqty)
+    else:
+        colors, counts = PaletteHistogramPy(fromcolor16, dotsqty, maxqty)
+
+    Listu16 = []
+    for val, qty in zip(colors, counts):
+        l0 = U16HEAD()
+        l0.colo16 = val
+        l0.A0 = val >> 11 & 31
+        l0.A1 = (val & 2016) >> 5
+        l0.A2 = val & 31
+        l0.qty = qty
+        Listu16.append(l0)
+    return Listu16
+
+
+def PaletteHistogramNp(fromcolor16, dotsqty, maxqty):
+    dots = np.asarray(fromcolor16, dtype=np.uint16)[:dotsqty]
+    colors, first = np.unique(dots, return_index=True)
+    if len(colors) >= maxqty:
+        # The original list building stops counting (even known colors) once the list is full
+        dots = dots[:np.sort(first)[maxqty - 1] + 1]
+        colors, first = np.unique(dots, return_index=True)
+    counts = np.bincount(dots, minlength=65536)[colors]
+    # Most frequent first, ties resolved as the insertion sort does: later first occurrence wins
+    order = np.lexsort((-first, -counts))
+    return colors[order].tolist(), counts[order].tolist()
+
+
+def PaletteHistogramPy(fromcolor16, dotsqty, maxqty):
+    dots = fromcolor16[:dotsqty]
+    colors = list(dict.fromkeys(dots))
+    if len(colors) >= maxqty:
+        # The original list building stops counting (even known colors) once the list is full
+        colors = colors[:maxqty]
+        dots = dots[:dots.index(colors[-1]) + 1]
+    counts = Counter(dots)
+    order = sorted(range(len(colors)), key=lambda i: (counts[colors[i]], i), reverse=True)
+    return [colors[i] for i in order], [counts[colors[i]] for i in order]
 
-    A0 = val >> 11 & 31
-    A1 = (val & 2016) >> 5
-    A2 = val & 31
-    Listu16[qty].colo16 = val
-    Listu16[qty].A0 = A0
-    Listu16[qty].A1 = A1
-    Listu16[qty].A2 = A2
-    Listu16[qty].qty = 1
-    ListQty = qty + 1
-    return ListQty
+
+# Replaces every dropped color by the nearest kept one (same pick as the one-by-one reduction)
+def ColPicQuantize(fromcolor16, dotsqty, kept, dropped):
+    if np is not None:
+        QuantizeNp(fromcolor16, dotsqty, kept, dropped)
+    else:
+        QuantizePy(fromcolor16, dotsqty, kept, dropped)
+
+
+def QuantizeNp(fromcolor16, dotsqty, kept, dropped):
+    keptA = np.array([(l0.A0, l0.A1, l0.A2) for l0 in kept], dtype=np.int16)
+    droppedA = np.array([(l0.A0, l0.A1, l0.A2) for l0 in dropped], dtype=np.int16)
+    # argmin returns the first of equally close colors, as the original scan did
+    fid = np.abs(droppedA[:, None, :] - keptA[None, :, :]).sum(axis=2).argmin(axis=1)
+    remap = np.arange(65536, dtype=np.uint16)
+    remap[[l0.colo16 for l0 in dropped]] = np.array([l0.colo16 for l0 in kept], dtype=np.uint16)[fid]
+    # View of the array, so the dots are remapped in place
+    dots = np.frombuffer(fromcolor16, dtype=np.uint16, count=dotsqty)
+    dots[:] = remap[dots]
+
+
+def QuantizePy(fromcolor16, dotsqty, kept, dropped):
+    remap = {}
+    for l0 in dropped:
+        fid = min(range(len(kept)), key=lambda i: abs(kept[i].A0 - l0.A0) + abs(kept[i].A1 - l0.A1) + abs(kept[i].A2 - l0.A2))
+        remap[l0.colo16] = kept[fid].colo16
+    fromcolor16[:dotsqty] = array('H', [remap.get(val, val) for val in fromcolor16[:dotsqty]])
 
 
 def Byte8bitEncode(fromcolor16, listu16Index, listqty, dotsqty, outputdata: bytearray, outputdataIndex, decMaxBytesize):
-    listu16 = outputdata
-    dots = 0
-    srcindex = 0
-    decindex = 0
-    lastid = 0
-    temp = 0
-    while dotsqty > 0:
-        dots = 1
-        for i in range(dotsqty - 1):
-            if fromcolor16[srcindex + i] != fromcolor16[srcindex + i + 1]:
-                break
-            dots += 1
-            if dots == 255:
-                break
-
-        temp = 0
-        for i in range(listqty):
-            aa = listu16[i * 2 + 1 + listu16Index] << 8
-            aa |= listu16[i * 2 + 0 + listu16Index]
-            if aa == fromcolor16[srcindex]:
-                temp = i
-                break
-
-        tid = int(temp % 32)
-        if tid > 255:
-            tid = 255
-        sid = int(temp / 32)
-        if sid > 255:
-            sid = 255
-        if lastid != sid:
-            if decindex >= decMaxBytesize:
-                dotsqty = 0
-                break
-            outputdata[decindex + outputdataIndex] = 7
-            outputdata[decindex + outputdataIndex] <<= 5
-            outputdata[decindex + outputdataIndex] += sid
-            decindex += 1
-            lastid = sid
-        if dots <= 6:
-            if decindex >= decMaxBytesize:
-                dotsqty = 0
-                break
-            aa = dots
-            if aa > 255:
-                aa = 255
-            outputdata[decindex + outputdataIndex] = aa
-            outputdata[decindex + outputdataIndex] <<= 5
-            outputdata[decindex + outputdataIndex] += tid
-            decindex += 1
-        else:
-            if decindex >= decMaxBytesize:
-                dotsqty = 0
-                break
-            outputdata[decindex + outputdataIndex] = 0
-            outputdata[decindex + outputdataIndex] += tid
-            decindex += 1
-            if decindex >= decMaxBytesize:
-                dotsqty = 0
-                break
-            aa = dots
-            if aa > 255:
-                aa = 255
-            outputdata[decindex + outputdataIndex] = aa
-            decindex += 1
-        srcindex += dots
-        dotsqty -= dots
+    listu16 = Color16FromBytes(outputdata[listu16Index:listu16Index + listqty * 2])
+    if np is not None:
+        encoded = Byte8bitEncodeNp(fromcolor16, listu16, dotsqty)
+    else:
+        encoded = Byte8bitEncodePy(fromcolor16, listu16, dotsqty)
 
+    # Running out of space just stops the encoding
+    decindex = max(0, min(len(encoded), decMaxBytesize))
+    outputdata[outputdataIndex:outputdataIndex + decindex] = encoded[:decindex]
     return decindex
 
 
+# Every run (up to 255 dots) is written as [7<<5 | sid] when sid changes, then
+# [dots<<5 | tid] for runs up to 6 dots or [tid, dots] for longer ones
+def Byte8bitEncodeNp(fromcolor16, listu16, dotsqty):
+    if dotsqty <= 0:
+        return b''
+    dots = np.asarray(fromcolor16, dtype=np.uint16)[:dotsqty]
+    starts = np.flatnonzero(dots[1:] != dots[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    runs = np.diff(np.concatenate((starts, [dotsqty])))
+
+    # Split runs longer than 255 dots
+    chunks = (runs + 254) // 255
+    colors = np.repeat(dots[starts], chunks)
+    runs = np.repeat(runs, chunks)
+    first = np.repeat(np.cumsum(chunks) - chunks, chunks)
+    dotsn = np.minimum(runs - (np.arange(len(runs)) - first) * 255, 255)
+
+    # Colors missing from the palette fall back to index 0
+    listid = np.zeros(65536, dtype=np.int32)
+    listid[np.asarray(listu16, dtype=np.uint16)[::-1]] = np.arange(len(listu16) - 1, -1, -1)
+    temp = listid[colors]
+    sid = temp >> 5
+    tid = temp & 31
+
+    sidchanged = sid != np.concatenate(([0], sid[:-1]))
+    longrun = dotsn > 6
+    sizes = sidchanged.astype(np.int64) + 1 + longrun
+    ends = np.cumsum(sizes)
+    encoded = np.zeros(ends[-1], dtype=np.uint8)
+    pos = ends - 1 - longrun
+    encoded[(pos - 1)[sidchanged]] = (224 + sid[sidchanged]).astype(np.uint8)
+    encoded[pos] = np.where(longrun, tid, (dotsn << 5) + tid).astype(np.uint8)
+    encoded[(pos + 1)[longrun]] = dotsn[longrun].astype(np.uint8)
+    return encoded.tobytes()
+
+
+def Byte8bitEncodePy(fromcolor16, listu16, dotsqty):
+    listid = {}
+    for i in range(len(listu16) - 1, -1, -1):
+        listid[listu16[i]] = i
+
+    encoded = bytearray()
+    lastid = 0
+    for color, group in groupby(fromcolor16[:dotsqty]):
+        temp = listid.get(color, 0)
+        tid = temp & 31
+        sid = temp >> 5
+        runqty = len(list(group))
+        while runqty > 0:
+            dots = min(runqty, 255)
+            if lastid != sid:
+                encoded.append(224 + sid)
+                lastid = sid
+            if dots <= 6:
+                encoded.append((dots << 5) + tid)
+            else:
+                encoded.append(tid)
+                encoded.append(dots)
+            runqty -= dots
+    return encoded
+
+
+# Reference decoder: ColPic_EncodeStr output -> (picw, pich, fromcolor16)
+def ColPic_DecodeStr(data):
+    return ColPicDecode(ColPicUnpackStr(data))
+
+
+def ColPicDecode(data):
+    if len(data) < 32:
+        raise ValueError('ColPic data is shorter than header')
+    encodever = data[0]
+    picw = int.from_bytes(data[4:8], 'little')
+    pich = int.from_bytes(data[8:12], 'little')
+    mark = int.from_bytes(data[12:16], 'little')
+    ListDataSize = int.from_bytes(data[16:20], 'little')
+    ColorDataSize = int.from_bytes(data[20:24], 'little')
+    if encodever != 3 or mark != 98419516:
+        raise ValueError(f'Unsupported ColPic header (version {encodever}, mark {mark})')
+
+    sizeofColPicHead3 = 32
+    listend = sizeofColPicHead3 + ListDataSize
+    if listend + ColorDataSize > len(data):
+        raise ValueError(f'ColPic data is truncated ({len(data)} bytes, {listend + ColorDataSize} expected)')
+    listu16 = Color16FromBytes(bytes(data[sizeofColPicHead3:listend]))
+    fromcolor16 = Byte8bitDecode(data[listend:listend + ColorDataSize], listu16)
+    if len(fromcolor16) != picw * pich:
+        raise ValueError(f'ColPic data has {len(fromcolor16)} dots, {picw}x{pich} expected')
+    return (picw, pich, fromcolor16)
+
+
+def Byte8bitDecode(encoded, listu16):
+    fromcolor16 = array('H')
+    sid = 0
+    i = 0
+    qty = len(encoded)
+    while i < qty:
+        temp = encoded[i]
+        i += 1
+        if temp >= 224:
+            sid = temp & 31
+            continue
+        dots = temp >> 5
+        if dots == 0:
+            if i >= qty:
+                raise ValueError('ColPic run length is missing')
+            dots = encoded[i]
+            i += 1
+        listid = (sid << 5) + (temp & 31)
+        if listid >= len(listu16):
+            raise ValueError(f'ColPic palette index {listid} is out of {len(listu16)} colors')
+        fromcolor16.extend([listu16[listid]] * dots)
+    return fromcolor16
+
+
 class U16HEAD:
 
     def __init__(self):
@@ -0,0 +1,156 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+import gzip
+import io
+import queue
+import threading
+
+# Compressed g-code (.gcode.gz, .gcode.zst) is read and written as stream, so memory use does not depend on file size.
+# gzip is handled by zlib, zstd needs zstandard module (imported only when zstd file is met)
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+MAGICS = ((b'\x1f\x8b', GZIP), (b'\x28\xb5\x2f\xfd', ZSTD))
+MAGIC_MAX_SIZE = 4
+EXTENSIONS = {GZIP: '.gz', ZSTD: '.zst'}
+# Size of decompressed chunks & write buffer
+STREAM_BUFFER_SIZE = 1024 * 1024
+# Max number of decompressed chunks waiting to be read
+READ_AHEAD_CHUNKS = 4
+DEFAULT_LEVELS = {GZIP: 6, ZSTD: 3}
+
+
+def detect(head: bytes) -> str:
+    """
+    Compression of file starting with head bytes (None for not compressed file)
+    """
+    for (magic, compression) in MAGICS:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception('zstandard module is required for zstd compressed files (pip install zstandard)') from None
+    return zstandard
+
+
+class ReadAhead(io.RawIOBase):
+    """
+    Reads (decompresses) stream in background thread, so decompression runs in parallel with parsing
+    (zlib & zstd release GIL). No more than READ_AHEAD_CHUNKS chunks are kept in memory
+    """
+    def __init__(self, stream, chunk_size=STREAM_BUFFER_SIZE, chunks=READ_AHEAD_CHUNKS):
+        self.stream = stream
+        self.chunks = queue.Queue(chunks)
+        self.pending = memoryview(b'')
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.worker, args=(chunk_size,), daemon=True)
+        self.thread.start()
+
+
+    def worker(self, chunk_size):
+        try:
+            while not self.stopped.is_set():
+                chunk = self.stream.read(chunk_size)
+                self.chunks.put(chunk)
+                if not chunk:
+                    return
+        except BaseException as ex:
+            # Re-raised by reader
+            self.chunks.put(ex)
+
+
+    def readable(self) -> bool:
+        return True
+
+
+    def readinto(self, buffer) -> int:
+        if not self.pending:
+            if self.eof:
+                return 0
+            chunk = self.chunks.get()
+            if isinstance(chunk, BaseException):
+                self.eof = True
+                raise chunk
+            if not chunk:
+                self.eof = True
+                return 0
+            self.pending = memoryview(chunk)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            # Worker blocked on full queue puts one more chunk at most, then sees the stop
+            while True:
+                try:
+                    self.chunks.get_nowait()
+                except queue.Empty:
+                    break
+            self.thread.join()
+            self.stream.close()
+        super().close()
+
+
+class GzipWriter(gzip.GzipFile):
+    """
+    gzip stream owning the file it writes to. Neither name (output goes to temporary file) nor time are stored,
+    so the same g-code is always compressed into the same bytes
+    """
+    def __init__(self, output_file, level):
+        self.file = open(output_file, 'wb')
+        try:
+            super().__init__(filename='', mode='wb', compresslevel=level, fileobj=self.file, mtime=0)
+        except BaseException:
+            self.file.close()
+            raise
+
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.file.close()
+
+
+def open_input(input_file, compression=None):
+    """
+    Binary stream of file content, decompressed on the fly in background thread
+    """
+    if compression is None:
+        return open(input_file, 'rb')
+    if compression == GZIP:
+        stream = gzip.open(input_file, 'rb')
+    elif compression == ZSTD:
+        # Files written by pzstd & multi-threaded zstd consist of several frames
+        stream = zstandard().ZstdDecompressor().stream_reader(open(input_file, 'rb'), read_size=STREAM_BUFFER_SIZE, read_across_frames=True, closefd=True)
+    else:
+        raise Exception(f'Unknown compression {compression}')
+    return io.BufferedReader(ReadAhead(stream), STREAM_BUFFER_SIZE)
+
+
+def open_output(output_file, compression=None, level=None, threads=0):
+    """
+    Binary stream compressing into file, threads is number of zstd worker threads (-1 for number of CPUs, 0 to compress in caller thread)
+    """
+    if compression is None:
+        return open(output_file, 'wb')
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+    if compression == GZIP:
+        stream = GzipWriter(output_file, level)
+    elif compression == ZSTD:
+        stream = zstandard().ZstdCompressor(level=level, threads=threads).stream_writer(open(output_file, 'wb'), closefd=True)
+    else:
+        raise Exception(f'Unknown compression {compression}')
+    # Slicer g-code is written line by line, compressors are called for big chunks only
+    return io.BufferedWriter(stream, STREAM_BUFFER_SIZE)
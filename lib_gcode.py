@@ -0,0 +1,90 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+import mmap
+import re
+
+from array import array
+from os import fstat
+
+
+# Searched as line break + pattern: with a literal prefix re can skip to candidates quickly,
+# so one pass per pattern is much faster than a single pass with alternation
+z_pattern = rb';Z:([^:\r\n]*)'
+m73_pattern = rb'M73 P(\d+) R(\d+)'
+layer_change_pattern = rb';LAYER_CHANGE'
+
+
+class GcodeScan:
+    """
+    Byte offsets (line starts) and values of the lines used for max height & print progress
+    """
+    def __init__(self):
+        self.z_offsets = array('q')
+        self.z_values = array('d')
+        self.m73_offsets = array('q')
+        self.m73_percentage = array('q')
+        self.m73_remaining = array('q')
+        self.layer_change_offsets = array('q')
+
+
+    def max_height(self) -> float:
+        return max(self.z_values, default=0)
+
+
+    def progress_edits(self) -> list:
+        """
+        Lines to be inserted as (offset, text): ';TIME:<print-duration-in-seconds>' before the first M73
+        and ';TIME_ELAPSED:<time-elapsed-in-seconds>' before every ';LAYER_CHANGE' after the next ones
+        """
+        edits = []
+        total_duration = None
+        time_elapsed = None
+        m73 = 0
+        m73_qty = len(self.m73_offsets)
+        for layer_change_offset in self.layer_change_offsets:
+            while m73 < m73_qty and self.m73_offsets[m73] < layer_change_offset:
+                t = self.m73_remaining[m73] * 60
+                if total_duration is None:
+                    total_duration = t
+                    edits.append((self.m73_offsets[m73], f';TIME:{total_duration}\n'))
+                else:
+                    time_elapsed = total_duration - t
+                m73 += 1
+            if time_elapsed is not None:
+                edits.append((layer_change_offset, f';TIME_ELAPSED:{time_elapsed}\n'))
+        if total_duration is None and m73 < m73_qty:
+            edits.append((self.m73_offsets[m73], f';TIME:{self.m73_remaining[m73] * 60}\n'))
+        return edits
+
+
+def find_lines(pattern, data, start=0):
+    """
+    Yield (offset of line start, match) for every line starting with pattern
+    """
+    if start == 0:
+        m = re.compile(pattern).match(data)
+        if m is not None:
+            yield (0, m)
+    for m in re.compile(b'\n' + pattern).finditer(data, max(0, start - 1)):
+        yield (m.start() + 1, m)
+
+
+def scan_gcode(input_file, start=0) -> GcodeScan:
+    """
+    Find all ';Z:', 'M73' & ';LAYER_CHANGE' lines of memory-mapped g-code file
+    """
+    result = GcodeScan()
+    with open(input_file, 'rb') as input:
+        if fstat(input.fileno()).st_size == 0:
+            return result
+        with mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for (offset, m) in find_lines(z_pattern, data, start):
+                result.z_offsets.append(offset)
+                result.z_values.append(float(m.group(1)))
+            for (offset, m) in find_lines(m73_pattern, data, start):
+                result.m73_offsets.append(offset)
+                result.m73_percentage.append(int(m.group(1)))
+                result.m73_remaining.append(int(m.group(2)))
+            for (offset, m) in find_lines(layer_change_pattern, data, start):
+                result.layer_change_offsets.append(offset)
+    return result
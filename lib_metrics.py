@@ -0,0 +1,100 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from os import path
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'neptune_thumbnail'
+
+
+class MetricsSink:
+    """
+    Writes metrics of every processed file as JSON line and totals of the run as node-exporter textfile
+    (the textfile is rewritten after every file, so it is up to date in daemon mode)
+    """
+    def __init__(self, jsonl_file=None, textfile=None):
+        self.jsonl_file = jsonl_file
+        self.textfile = textfile
+        self.lock = threading.Lock()
+        self.files = {'ok': 0, 'failed': 0}
+        self.stages = {}
+        self.totals = {'input_bytes': 0, 'output_bytes': 0, 'lines_parsed': 0, 'cache_hits': 0, 'cache_misses': 0}
+        self.block_bytes = {}
+        self.last_file_time = None
+
+
+    def add(self, input_file, error, metrics):
+        """
+        Record result of one file, metrics is Neptune_Thumbnail.metrics() or None when processing did not start
+        """
+        metrics = metrics or {}
+        with self.lock:
+            self.last_file_time = time.time()
+            self.files['ok' if error is None else 'failed'] += 1
+            for (stage, clocks) in metrics.get('stages', {}).items():
+                totals = self.stages.setdefault(stage, {'wall': 0.0, 'cpu': 0.0})
+                for clock in totals:
+                    totals[clock] += clocks[clock]
+            for key in self.totals:
+                self.totals[key] += metrics.get(key) or 0
+            for (image, size) in metrics.get('block_bytes', {}).items():
+                self.block_bytes[image] = self.block_bytes.get(image, 0) + size
+
+            try:
+                if self.jsonl_file is not None:
+                    self.write_jsonl(dict(time=self.last_file_time, input_file=input_file, error=error, **metrics))
+                if self.textfile is not None:
+                    self.write_textfile()
+            except OSError:
+                logger.exception('Failed to write metrics')
+
+
+    def write_jsonl(self, record):
+        line = (json.dumps(record, sort_keys=True) + '\n').encode('utf8')
+        # Single append write, so lines of several processes are not mixed
+        fd = os.open(self.jsonl_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+    def write_textfile(self):
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f'# HELP {PREFIX}_{name} {help}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+            for (labels, value) in samples:
+                labels = ','.join(f'{key}="{value}"' for (key, value) in labels.items())
+                lines.append(f'{PREFIX}_{name}{{{labels}}} {value}' if labels else f'{PREFIX}_{name} {value}')
+
+        metric('files_total', 'counter', 'Processed g-code files', [({'status': status}, qty) for (status, qty) in self.files.items()])
+        metric('stage_seconds_total', 'counter', 'Time spent in processing stages (nested stages are included into outer ones)',
+               [({'stage': stage, 'clock': clock}, round(seconds, 6)) for (stage, clocks) in sorted(self.stages.items()) for (clock, seconds) in clocks.items()])
+        metric('input_bytes_total', 'counter', 'Size of processed g-code files', [({}, self.totals['input_bytes'])])
+        metric('output_bytes_total', 'counter', 'Size of written g-code files', [({}, self.totals['output_bytes'])])
+        metric('lines_parsed_total', 'counter', 'G-code lines parsed', [({}, self.totals['lines_parsed'])])
+        metric('encoded_bytes_total', 'counter', 'Size of encoded images', [({'image': image}, size) for (image, size) in sorted(self.block_bytes.items())])
+        metric('cache_requests_total', 'counter', 'Encoded images cache requests',
+               [({'result': 'hit'}, self.totals['cache_hits']), ({'result': 'miss'}, self.totals['cache_misses'])])
+        metric('last_file_timestamp_seconds', 'gauge', 'Time the last file was processed', [({}, round(self.last_file_time, 3))])
+
+        # node-exporter must never see partially written file
+        directory = path.dirname(path.abspath(self.textfile))
+        (fd, temp_name) = tempfile.mkstemp(prefix='.tmp-', suffix='.prom', dir=directory)
+        try:
+            with open(fd, 'w', encoding='utf8', newline='\n') as output:
+                output.write('\n'.join(lines) + '\n')
+            os.chmod(temp_name, 0o644)
+            os.replace(temp_name, self.textfile)
+        except BaseException:
+            os.remove(temp_name)
+            raise
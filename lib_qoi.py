@@ -0,0 +1,76 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+import struct
+
+# QOI image format (PrusaSlicer's 'thumbnail_QOI'), see https://qoiformat.org/qoi-specification.pdf
+
+MAGIC = b'qoif'
+HEADER = struct.Struct('>4sIIBB')
+END_MARKER = b'\x00' * 7 + b'\x01'
+
+OP_RGB = 0xfe
+OP_RGBA = 0xff
+
+
+def decode(data: bytes) -> tuple:
+    """
+    Decode QOI image into (width, height, channels, RGBA pixels). Pixel is kept as one int (R in the high byte), runs are
+    added as repeated bytes, so the loop is done once per chunk instead of once per pixel
+    """
+    if len(data) < HEADER.size + len(END_MARKER):
+        raise Exception('QOI image is truncated')
+    (magic, width, height, channels, colorspace) = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise Exception('Not a QOI image')
+    if channels not in (3, 4) or width == 0 or height == 0:
+        raise Exception(f'Unsupported QOI image {width}x{height} with {channels} channels')
+
+    size = width * height * 4
+    pixels = bytearray()
+    index = [0] * 64
+    px = 0x000000ff
+    last = px.to_bytes(4, 'big')
+    pos = HEADER.size
+    end = len(data) - len(END_MARKER)
+    while pos < end and len(pixels) < size:
+        b1 = data[pos]
+        pos += 1
+        if b1 == OP_RGB:
+            px = (data[pos] << 24) | (data[pos + 1] << 16) | (data[pos + 2] << 8) | (px & 0xff)
+            pos += 3
+        elif b1 == OP_RGBA:
+            px = (data[pos] << 24) | (data[pos + 1] << 16) | (data[pos + 2] << 8) | data[pos + 3]
+            pos += 4
+        elif b1 < 0x40:
+            # QOI_OP_INDEX, hash is not updated as the pixel is already there
+            px = index[b1]
+            last = px.to_bytes(4, 'big')
+            pixels += last
+            continue
+        elif b1 < 0x80:
+            # QOI_OP_DIFF
+            px = ((((px >> 24) + (b1 >> 4 & 3) - 2) & 0xff) << 24
+                  | (((px >> 16) + (b1 >> 2 & 3) - 2) & 0xff) << 16
+                  | (((px >> 8) + (b1 & 3) - 2) & 0xff) << 8
+                  | (px & 0xff))
+        elif b1 < 0xc0:
+            # QOI_OP_LUMA
+            b2 = data[pos]
+            pos += 1
+            vg = (b1 & 0x3f) - 32
+            px = ((((px >> 24) + vg - 8 + (b2 >> 4)) & 0xff) << 24
+                  | (((px >> 16) + vg) & 0xff) << 16
+                  | (((px >> 8) + vg - 8 + (b2 & 0x0f)) & 0xff) << 8
+                  | (px & 0xff))
+        else:
+            # QOI_OP_RUN of the previous pixel, index is not updated (encoder does it for the first pixel of run only)
+            pixels += last * ((b1 & 0x3f) + 1)
+            continue
+        index[((px >> 24) * 3 + (px >> 16 & 0xff) * 5 + (px >> 8 & 0xff) * 7 + (px & 0xff) * 11) & 63] = px
+        last = px.to_bytes(4, 'big')
+        pixels += last
+
+    if len(pixels) < size:
+        raise Exception('QOI image is truncated')
+    del pixels[size:]
+    return (width, height, channels, bytes(pixels))
@@ -0,0 +1,79 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+# Startup profiler: has to stay cheap to import, so it only depends on builtins
+
+import builtins
+import sys
+import time
+
+started = time.perf_counter()
+last_stage = started
+installed = False
+# (module, self time, cumulative time, nesting depth) in order imports are completed
+imports = []
+# (stage, duration)
+stages = []
+import_stack = []
+original_import = builtins.__import__
+
+
+def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """
+    __import__ replacement that measures every first-time import
+    """
+    if level:
+        return original_import(name, globals, locals, fromlist, level)
+    if name not in sys.modules:
+        label = name
+    else:
+        # from package import submodule
+        missing = [item for item in (fromlist or ()) if f'{name}.{item}' not in sys.modules]
+        if not missing:
+            return original_import(name, globals, locals, fromlist, level)
+        label = f'{name}.{",".join(missing)}'
+
+    import_stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        children = import_stack.pop()
+        if import_stack:
+            import_stack[-1] += elapsed
+        imports.append((label, elapsed - children, elapsed, len(import_stack)))
+
+
+def install():
+    global installed
+    builtins.__import__ = timed_import
+    installed = True
+
+
+def stage(name):
+    """
+    Mark the end of startup stage
+    """
+    global last_stage
+    if installed:
+        now = time.perf_counter()
+        stages.append((name, now - last_stage))
+        last_stage = now
+
+
+def report(output=None, min_time=0.001):
+    """
+    Print stage durations and imports that took at least min_time seconds
+    """
+    output = output or sys.stdout
+    total = time.perf_counter() - started
+    print(f'Startup profile: {total * 1000:.1f} ms since script start', file=output)
+    print('Stages (ms):', file=output)
+    for (name, duration) in stages:
+        print(f'  {duration * 1000:9.1f}  {name}', file=output)
+    print('Imports (ms):', file=output)
+    print(f'  {"self":>9}  {"total":>9}  module', file=output)
+    for (name, self_time, cumulative, depth) in imports:
+        if cumulative >= min_time:
+            print(f'  {self_time * 1000:9.1f}  {cumulative * 1000:9.1f}  {"  " * depth}{name}', file=output)
+    print(f'  {"":>9}  {sum(i[2] for i in imports if i[3] == 0) * 1000:9.1f}  (all imports)', file=output)
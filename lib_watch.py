@@ -0,0 +1,126 @@
+# The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+import time
+
+from fnmatch import fnmatch
+from os import path
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def file_signature(file_name) -> tuple:
+    """
+    (inode, size, mtime) of file or None if it does not exist anymore
+    """
+    try:
+        st = os.stat(file_name)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def matches(name, patterns) -> bool:
+    return any(fnmatch(name, pattern) for pattern in patterns)
+
+
+class PollingWatcher:
+    """
+    Reports files that have been created or modified and then kept unchanged for settle_time seconds
+    """
+    def __init__(self, directories, patterns, interval=1.0, settle_time=2.0):
+        self.directories = directories
+        self.patterns = patterns
+        self.interval = interval
+        self.settle_time = settle_time
+        # Files existing at start are not reported
+        self.files = {file_name: (signature, 0, True) for (file_name, signature) in self.scan()}
+
+
+    def scan(self):
+        for directory in self.directories:
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                logger.exception(f'Failed to list directory {directory}')
+                continue
+            for name in names:
+                if matches(name, self.patterns):
+                    file_name = path.join(directory, name)
+                    signature = file_signature(file_name)
+                    if signature is not None:
+                        yield (file_name, signature)
+
+
+    def changes(self):
+        while True:
+            now = time.monotonic()
+            files = {}
+            for (file_name, signature) in self.scan():
+                (known_signature, changed, reported) = self.files.get(file_name, (None, now, False))
+                if signature != known_signature:
+                    files[file_name] = (signature, now, False)
+                elif not reported and now - changed >= self.settle_time:
+                    files[file_name] = (signature, changed, True)
+                    yield file_name
+                else:
+                    files[file_name] = (known_signature, changed, reported)
+            self.files = files
+            time.sleep(self.interval)
+
+
+class InotifyWatcher:
+    """
+    Reports files that have been closed after writing or moved into directories (Linux only)
+    """
+    def __init__(self, directories, patterns):
+        self.patterns = patterns
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+            self.directories[wd] = directory
+
+
+    def changes(self):
+        while True:
+            data = os.read(self.fd, 64 * 1024)
+            pos = 0
+            while pos < len(data):
+                (wd, mask, cookie, length) = INOTIFY_EVENT.unpack_from(data, pos)
+                pos += INOTIFY_EVENT.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                if name and wd in self.directories and matches(name, self.patterns):
+                    yield path.join(self.directories[wd], name)
+
+
+def create_watcher(directories, patterns, polling=False):
+    """
+    inotify watcher where available, polling watcher otherwise
+    """
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            watcher = InotifyWatcher(directories, patterns)
+            logger.info(f'Watching {", ".join(directories)} using inotify')
+            return watcher
+        except (OSError, AttributeError, TypeError):
+            logger.exception('inotify is not available, falling back to polling')
+    logger.info(f'Watching {", ".join(directories)} using polling')
+    return PollingWatcher(directories, patterns)
@@ -8,27 +8,96 @@
 # The ElegooNeptuneThumbnailPrusaMod plugin is released under the terms of the AGPLv3 or higher.
 
 
+from __future__ import annotations
+
+import sys
+
+import lib_startup
+
+if __name__ == '__main__' and ('--profile_startup' in sys.argv or '--profile-startup' in sys.argv):
+    lib_startup.install()
+
 import argparse
 import base64
+import binascii
 import logging
-import platform
+import os
 import re
-import sys
+import signal
+import time
 
-from array import array
-from ctypes import *
-from io import BytesIO
-from os import path, replace
+from functools import wraps
+from io import BytesIO, TextIOWrapper
+from os import SEEK_END, fstat, path, replace
 
-from PIL import Image, ImageOps, ImageDraw,ImageFont
+import lib_bgcode
+import lib_compress
+import lib_gcode
+import lib_qoi
 
-import lib_col_pic
+# PIL, lib_col_pic and modules used by batch/daemon modes are imported where needed: slicer waits for the script
+# after every export, so files without thumbnail should not pay for them. numpy is used by batch/daemon workers only
 
 script_dir = path.dirname(sys.argv[0])
-log_file = path.join(script_dir, path.splitext(sys.argv[0])[0] + '.log')
-logging.basicConfig(level=logging.DEBUG, filename=log_file, filemode="w", format="%(asctime)s - %(levelname)s - %(message)s")
+log_file = path.splitext(sys.argv[0])[0] + '.log'
 logger = logging.getLogger(__name__)
 
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+FOOTER_MAX_SIZE = 4 * 1024 * 1024
+# The last ';Z:' is usually a few KB from the end, so small blocks are read (a bigger one costs more than the seeks it saves)
+FOOTER_BLOCK_SIZE = 64 * 1024
+ZERO_COPY_MAX_SIZE = 1024 * 1024 * 1024
+CACHE_SIZE = 64 * 1024 * 1024
+# Files taken from directories (binary g-code is converted into text one)
+GCODE_PATTERNS = ('*.gcode', '*.bgcode', '*.gcode.gz', '*.gcode.zst')
+
+
+def setup_logging(debug=False, filemode='w'):
+    """
+    Log into file next to the script, the file is not touched till the first record
+    """
+    logging.basicConfig(
+        level=logging.DEBUG if debug else logging.INFO,
+        handlers=[logging.FileHandler(log_file, filemode, delay=True)],
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+
+
+def timed_stage(method):
+    """
+    Decorator adding method wall & CPU time into self.timings & self.cpu_timings (seconds by method name, nested stages are included into outer ones)
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            add_timing(self, method.__name__, start, cpu_start)
+    return wrapper
+
+
+def timed_image_stage(method):
+    """
+    Decorator like timed_stage for encoders called with image prefix, every image is timed separately
+    ('image_encode_new:gimage', the same names as block_bytes & palette_colors use)
+    """
+    @wraps(method)
+    def wrapper(self, img, prefix, *args, **kwargs):
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            return method(self, img, prefix, *args, **kwargs)
+        finally:
+            add_timing(self, f'{method.__name__}:{prefix.strip(";:")}', start, cpu_start)
+    return wrapper
+
+
+def add_timing(obj, stage, start, cpu_start):
+    obj.timings[stage] = obj.timings.get(stage, 0.0) + time.perf_counter() - start
+    obj.cpu_timings[stage] = obj.cpu_timings.get(stage, 0.0) + time.process_time() - cpu_start
+
 
 def myround(svalue, divider=1) -> str:
     f = float(svalue) / divider
@@ -38,6 +107,369 @@ def myround(svalue, divider=1) -> str:
         return str(round(f));
 
 
+# Font faces to try in order, font bundled with Pillow is used when none of them is installed
+FONT_FACES = ('Helvetica', 'Arial', 'DejaVuSans')
+
+# Per process caches, so batch and daemon workers load fonts only once
+font_face_cache = {}
+font_cache = {}
+text_length_cache = {}
+
+
+def get_font(size: int, faces=FONT_FACES):
+    """
+    Load font of the first available face (cached by face and size)
+    """
+    from PIL import ImageFont
+
+    if faces not in font_face_cache:
+        font_face_cache[faces] = None
+        for face in faces:
+            try:
+                font_cache[(face, size)] = ImageFont.truetype(face, size)
+                font_face_cache[faces] = face
+                break
+            except OSError:
+                logger.debug(f'Font {face} not found')
+    face = font_face_cache[faces]
+
+    font = font_cache.get((face, size))
+    if font is None:
+        font = ImageFont.truetype(face, size) if face is not None else ImageFont.load_default(size)
+        font_cache[(face, size)] = font
+    return font
+
+
+def get_text_length(draw, text: str, size: int, faces=FONT_FACES) -> float:
+    """
+    Text width drawn with draw.font (cached by face, size and text)
+    """
+    key = (font_face_cache.get(faces), size, text)
+    length = text_length_cache.get(key)
+    if length is None:
+        length = draw.textlength(text)
+        text_length_cache[key] = length
+    return length
+
+
+# Screen background of new printers, transparent images are composited on it
+NEPTUNE_BACKGROUND = (46, 51, 72)
+
+# Page background of Klipper's web interfaces (dark & light theme), JPG images have no transparency to show it
+KLIPPER_BACKGROUND_DARK = (18, 18, 18)
+KLIPPER_BACKGROUND_LIGHT = (255, 255, 255)
+
+
+# Lookup tables to build RGB565 bytes: high byte is RRRRRGGG, low byte is GGGBBBBB
+RGB565_R_HI = bytes(v & 0xF8 for v in range(256))
+RGB565_G_HI = bytes(v >> 5 for v in range(256))
+RGB565_G_LO = bytes((v & 0x1C) << 3 for v in range(256))
+RGB565_B_LO = bytes(v >> 3 for v in range(256))
+
+
+def rgb565_le(img: Image) -> bytearray:
+    """
+    Convert whole image into little-endian RGB565 buffer
+    """
+    data = (img if img.mode == 'RGB' else img.convert('RGB')).tobytes()
+    qty = len(data) // 3
+    r = data[0::3]
+    g = data[1::3]
+    b = data[2::3]
+    # OR-ing the channels as big integers keeps the whole conversion out of the Python loop
+    hi = int.from_bytes(r.translate(RGB565_R_HI), 'little') | int.from_bytes(g.translate(RGB565_G_HI), 'little')
+    lo = int.from_bytes(g.translate(RGB565_G_LO), 'little') | int.from_bytes(b.translate(RGB565_B_LO), 'little')
+    result = bytearray(qty * 2)
+    result[0::2] = lo.to_bytes(qty, 'little')
+    result[1::2] = hi.to_bytes(qty, 'little')
+    return result
+
+
+def colpic_frame(data, prefix: str) -> str:
+    """
+    Split encoded image into prefixed lines of 1015 chars, the last one prefixed with an extra ';', and add padding
+    """
+    each_max = 1024 - 8 - 1
+    data_len = len(data)
+    # Line break positions and padding length are the ones printers got so far (calculated from data length + 10)
+    last_line = int((data_len + 10) / each_max) * each_max
+    append_len = each_max - 3 - (data_len + 10) % each_max + 10
+    prefix_bytes = prefix.encode('ascii')
+    pieces = []
+    for pos in range(0, data_len, each_max):
+        if pos == last_line:
+            pieces.append(b'\r;' + prefix_bytes)
+        elif pos == 0:
+            pieces.append(prefix_bytes)
+        else:
+            pieces.append(b'\r' + prefix_bytes)
+        pieces.append(data[pos:pos + each_max])
+    pieces.append(b'\r;' + b'0' * append_len)
+    return b''.join(pieces).decode('ascii')
+
+
+def colpic_unframe(text) -> dict:
+    """
+    Encoded images by prefix from lines produced by colpic_frame (e.g. the first line of g-code file)
+    """
+    result = {}
+    for line in text.split('\r'):
+        line = line.strip()
+        if line.startswith(';;'):
+            line = line[1:]
+        for prefix in (';gimage:', ';simage:'):
+            if line.startswith(prefix):
+                result[prefix] = result.get(prefix, '') + line[len(prefix):]
+                break
+    return result
+
+
+def thumbnail_tag(img_type: str) -> str:
+    """
+    Name of thumbnail comment block for image format, PNG ones have no suffix
+    """
+    return 'thumbnail' if img_type == 'PNG' else f'thumbnail_{img_type}'
+
+
+def thumbnail_text(base64_str: str, width, height, tag='thumbnail', base64_block_len=78) -> str:
+    """
+    Base64 encoded image as g-code comments (the way slicers write thumbnails)
+    """
+    base64_len = len(base64_str)
+    result = f'\n; {tag} begin {width}x{height} {base64_len}\n'
+    for pos in range(0, base64_len, base64_block_len):
+        result += f'; {base64_str[pos:pos+base64_block_len]}\n'
+    result += f'; {tag} end\n\n'
+    return result
+
+
+def copy_bytes(src, dst, length):
+    """
+    Copy exactly length bytes from src into dst
+    """
+    while length > 0:
+        chunk = src.read(min(length, COPY_BUFFER_SIZE))
+        if not chunk:
+            raise Exception(f'Unexpected end of file, {length} bytes are missing')
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def zero_copy_methods() -> list:
+    """
+    Kernel-side file to file copy functions available on this platform, as f(in_fd, out_fd, offset, count) -> copied
+    """
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(lambda in_fd, out_fd, offset, count: os.copy_file_range(in_fd, out_fd, count, offset))
+    if hasattr(os, 'sendfile'):
+        methods.append(lambda in_fd, out_fd, offset, count: os.sendfile(out_fd, in_fd, offset, count))
+    return methods
+
+
+def copy_range(input, output, offset, length, methods):
+    """
+    Copy length bytes starting at offset from input to output (binary files), without passing the data
+    through user space when possible. Methods failing for these files are removed from methods.
+    """
+    if length <= 0:
+        return
+    output.flush()
+    while length > 0 and methods:
+        try:
+            copied = methods[0](input.fileno(), output.fileno(), offset, min(length, ZERO_COPY_MAX_SIZE))
+        except OSError:
+            # Not supported for this pair of files (e.g. different file systems or sendfile() on macOS requiring socket)
+            methods.pop(0)
+            continue
+        if copied == 0:
+            # Some file systems stop early, the rest is copied the usual way (which finds a real end of file)
+            break
+        offset += copied
+        length -= copied
+    if length > 0:
+        input.seek(offset)
+        copy_bytes(input, output, length)
+
+
+def reversed_lines(input, max_size, block_size=FOOTER_BLOCK_SIZE):
+    """
+    Yield lines of binary file starting from the end (reading no more than max_size bytes)
+    """
+    input.seek(0, SEEK_END)
+    pos = input.tell()
+    limit = max(0, pos - max_size)
+    rest = b''
+    while pos > limit:
+        size = min(block_size, pos - limit)
+        pos -= size
+        input.seek(pos)
+        lines = (input.read(size) + rest).split(b'\n')
+        rest = lines[0]
+        yield from reversed(lines[1:])
+    if limit == 0:
+        yield rest
+
+
+def line_offsets(input_file, indexes) -> dict:
+    """
+    Byte offsets of lines with given indexes (lines are counted as text mode does: '\\n', '\\r\\n' & '\\r' are line breaks),
+    file size is stored with None key
+    """
+    result = {}
+    wanted = set(indexes)
+    index = 0
+    offset = 0
+    with open(input_file, 'rb') as input:
+        for raw in input:
+            if not wanted:
+                break
+            for line in universal_line_regex.findall(raw):
+                if index in wanted:
+                    result[index] = offset
+                    wanted.discard(index)
+                index += 1
+                offset += len(line)
+        input.seek(0, SEEK_END)
+        result[None] = input.tell()
+    for index in wanted:
+        result[index] = result[None]
+    return result
+
+
+def read_chunks(input, size=COPY_BUFFER_SIZE):
+    """
+    Yield content of binary stream in chunks of whole lines (the last one may lack line break)
+    """
+    rest = b''
+    while True:
+        data = input.read(size)
+        if not data:
+            if rest:
+                yield rest
+            return
+        data = rest + data
+        end = data.rfind(b'\n') + 1
+        rest = data[end:]
+        if end > 0:
+            yield data[:end]
+
+
+def decode_line(line: bytes) -> str:
+    """
+    Line as text mode reads it ('\\r\\n' is translated to '\\n')
+    """
+    line = line.decode('utf8')
+    if line.endswith('\r\n'):
+        return line[:-2] + '\n'
+    return line
+
+
+def chunk_lines(pattern, chunk, start=0):
+    """
+    Yield (index of line counted from start, start offset, end offset, decoded line) for every line of chunk starting with pattern
+    """
+    index = 0
+    pos = start
+    for (offset, m) in lib_gcode.find_lines(pattern, chunk, start):
+        end = chunk.find(b'\n', offset) + 1 or len(chunk)
+        index += chunk.count(b'\n', pos, offset)
+        yield (index, offset, end, decode_line(chunk[offset:end]))
+        pos = offset
+
+
+def chunk_lines_qty(chunk, start=0) -> int:
+    return chunk.count(b'\n', start) + (1 if start < len(chunk) and not chunk.endswith(b'\n') else 0)
+
+
+def converted_name(file_name, binary=False, input_compression=None, output_compression=None) -> str:
+    """
+    Name of file the result is saved to: binary g-code becomes text one (.gcode), compression extension follows output compression
+    """
+    if not binary and output_compression == input_compression:
+        return file_name
+    (base, ext) = path.splitext(file_name)
+    if input_compression is not None and ext.lower() == lib_compress.EXTENSIONS[input_compression]:
+        file_name = base
+    if binary:
+        file_name = path.splitext(file_name)[0] + '.gcode'
+    if output_compression is not None:
+        file_name += lib_compress.EXTENSIONS[output_compression]
+    return file_name
+
+
+class Base64Decoder:
+    """
+    Decodes base64 text written in pieces of any size into bytes buffer, everything outside of base64 alphabet
+    (comment prefixes, line breaks) is skipped
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.rest = b''
+
+
+    def write(self, text: bytes):
+        text = self.rest + text.translate(None, BASE64_SKIPPED)
+        size = len(text) & ~3
+        self.data += binascii.a2b_base64(text[:size])
+        self.rest = text[size:]
+
+
+    def result(self) -> bytes:
+        if self.rest:
+            # Raises on incomplete text
+            self.data += binascii.a2b_base64(self.rest)
+            self.rest = b''
+        return bytes(self.data)
+
+
+class ThumbnailBlock:
+    """
+    Thumbnail embedded into g-code: size, format (PNG, JPG, QOI), lines of '; thumbnail begin/end' and byte range of base64
+    text between them. Image data is decoded when needed, or while parsing from streams that can not be read again
+    """
+    def __init__(self, width, height, format='PNG', begin=None):
+        self.width = width
+        self.height = height
+        self.format = format
+        self.begin = begin
+        self.end = None
+        self.offset = None
+        self.length = None
+        self.decoder = None
+        self.data = None
+
+
+class BlockWriter:
+    """
+    Output of image block: text goes into output and into cache entry (if any), its size is counted for metrics
+    """
+    def __init__(self, output, entry=None):
+        self.output = output
+        self.entry = entry
+        self.size = 0
+
+
+    def write(self, text: str):
+        self.output.write(text)
+        self.size += len(text)
+        if self.entry is not None:
+            self.entry.write(text)
+
+
+class EncodingWriter:
+    """
+    Text interface of binary output: text is encoded and '\\n' translated right away, so writes can be mixed with binary ones
+    """
+    def __init__(self, output, newline='\n'):
+        self.output = output
+        self.newline = newline
+
+
+    def write(self, text):
+        self.output.write(text.replace('\n', self.newline).encode('utf8'))
+
+
 def extract_value(line, key) -> str:
     p = line.find(key)
     if p < 0:
@@ -50,8 +482,28 @@ def extract_value(line, key) -> str:
         return line[pv:].strip()
 
 
+# Print summary comments: (key, attribute, description)
+summary_keys = (
+    ('estimated printing time (normal mode) =', 'print_duration', 'Print duration'),
+    ('total filament used [g] =', 'filament_used_weight', 'Filament used [g]'),
+    ('filament used [mm] =', 'filament_used_length', 'Filament used [mm]'),
+    ('total filament cost =', 'filament_cost', 'Filament cost'),
+)
+
+universal_line_regex = re.compile(rb'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+line_regex = re.compile(rb'[^\n]*\n|[^\n]+')
+
+# Lines rewrite_line() adds print progress for
+progress_line_pattern = rb'(?:M73 P|;LAYER_CHANGE)'
+
+thumbnail_regex = re.compile(r'; thumbnail(?:_(?P<format>JPG|QOI))? (?P<state>begin|end)(?: (?P<width>\d+)x(?P<height>\d+))?')
+# Pillow format names of thumbnail formats
+PIL_FORMATS = {'PNG': 'PNG', 'JPG': 'JPEG', 'QOI': 'QOI'}
+BASE64_SKIPPED = bytes(set(range(256)) - set(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='))
+
+
 class Neptune_Thumbnail:
-    def __init__(self, input_file, old_printer=False, image_size=None, debug=False, short_duration_format=False, update_original_image=False, original_image_light_theme=False):
+    def __init__(self, input_file, old_printer=False, image_size=None, debug=False, short_duration_format=False, update_original_image=False, original_image_light_theme=False, single_pass=False, cache_dir=None, cache_size=CACHE_SIZE, output_compression=None, compression_level=None, compression_threads=0):
         self.input_file = input_file
         self.debug = debug
         self.filament_cost = None
@@ -62,14 +514,20 @@ class Neptune_Thumbnail:
         self.header = ''
         self.header_line = None
         self.img_base64_block_len = 78
-        self.img_encoded = ''
+        self.img_klipper = None
         self.img_encoded_begin = None
         self.img_encoded_end = None
         self.img_size = image_size
+        self.img_size_requested = image_size
         self.img_type = None
         self.img_type_detected = None
         self.img_width = None
         self.img_height = None
+        self.thumbnails = []
+        self.thumbnail = None
+        self.thumbnail_open = None
+        # Base64 text is decoded from byte ranges when input file can be read again
+        self.decode_thumbnail_lines = True
         self.max_height = 0
         self.max_height_formatted = None
         self.original_image_light_theme = original_image_light_theme
@@ -80,18 +538,46 @@ class Neptune_Thumbnail:
         self.orca_mask = 'Orca-Slicer'
         self.prusa_mask = 'Prusa-Slicer'
         self.run_old_printer = old_printer
-
-        logger.info(f'Input file: {args.input_file}')
+        self.single_pass = single_pass
+        self.cache = None
+        self.timings = {}
+        self.cpu_timings = {}
+        self.input_size = None
+        self.output_size = None
+        self.lines_parsed = 0
+        self.palette_colors = {}
+        self.block_bytes = {}
+        self.time_elapsed = None
+        self.total_duration = None
+        self.bgcode_metadata = {}
+        self.bgcode_thumbnails = []
+        self.bgcode_gcode_offset = None
+        self.input_binary = False
+        self.input_compression = None
+        self.output_compression = None
+        self.output_compression_requested = output_compression
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
+
+        self.log_debug(f'Input file: {self.input_file}')
         if self.img_size is None:
-            logger.info('The first thumbnail from input file larger than 100x100 will be used')
+            self.log_debug('The first thumbnail from input file larger than 100x100 will be used')
         else:
-            logger.info(f'Will try to find thumbnail with specified size: {self.img_size}')
+            self.log_debug(f'Will try to find thumbnail with specified size: {self.img_size}')
         if self.print_duration_short_format:
-            logger.info('Using short pring duration format')
+            self.log_debug('Using short pring duration format')
         if self.run_old_printer:
-            logger.info('Using older printer settings')
+            self.log_debug('Using older printer settings')
         if self.update_original_image:
-            logger.info('Original image will be updated')
+            self.log_debug('Original image will be updated')
+        if self.single_pass:
+            self.log_debug('Input file will be read in single pass')
+        if self.output_compression_requested is not None:
+            self.log_debug(f'Output compression: {self.output_compression_requested}')
+        if cache_dir is not None:
+            import lib_cache
+            self.cache = lib_cache.BlockCache(cache_dir, cache_size)
+            self.log_debug(f'Encoded images are cached in {cache_dir}')
 
 
     def log_debug(self, str):
@@ -99,69 +585,181 @@ class Neptune_Thumbnail:
             logger.debug(str)
 
 
+    @timed_stage
     def parse(self):
         self.log_debug('Parsing file')
 
-        img_size_regex = re.compile(r'(?P<size>(?P<width>\d+)x(?P<height>\d+))')
-        img_end_token = '; thumbnail end'
-        img_size = self.img_size
+        (footer, footer_complete) = self.read_footer()
+        head_only = False
+        index = -1
+        self.decode_thumbnail_lines = False
         with open(self.input_file, 'r', encoding='utf8') as input:
             for index, line in enumerate(input):
-                if line.startswith('; generated by '):
-                    self.header = line
-                    self.header_line = index
-                    self.log_debug(f'"generated by" found at line {index}')
-                elif 'estimated printing time (normal mode) =' in line:
-                    self.print_duration = extract_value(line, 'estimated printing time (normal mode) =')
-                    self.log_debug(f'Print duration "{self.print_duration}" found at line {index}')
-                elif 'total filament used [g] =' in line:
-                    self.filament_used_weight = extract_value(line, 'total filament used [g] =')
-                    self.log_debug(f'Filament used [g] "{self.filament_used_weight}" found at line {index}')
-                elif 'filament used [mm] =' in line:
-                    self.filament_used_length = extract_value(line, 'filament used [mm] =')
-                    self.log_debug(f'Filament used [mm] "{self.filament_used_length}" found at line {index}')
-                elif 'total filament cost =' in line:
-                    self.filament_cost = extract_value(line, 'total filament cost =')
-                    self.log_debug(f'Filament cost "{self.filament_cost}" found at line {index}')
-                elif line.startswith(';Z:'):
-                    value = line.split(':')
-                    height = float(value[1].strip())
-                    if height > self.max_height:
-                        self.max_height = height
-                elif line.startswith('; thumbnail') and ' begin' in line:
-                    found = False
-                    if self.img_size is None:
-                        m = img_size_regex.search(line)
-                        if m is not None and int(m.group('width')) >= 100 and int(m.group('height')) >= 100:
-                            found = True
-                            self.img_size = m.group('size')
-                    elif f' {self.img_size} ' in line:
-                        found = True
-                    if found:
-                        _ = self.img_size.split('x')
-                        self.img_width = int(_[0])
-                        self.img_height = int(_[1])
-                        self.img_encoded_begin = index
-                        if 'thumbnail_JPG' in line:
-                            self.img_type = 'JPG'
-                            img_end_token = '; thumbnail_JPG end'
-                        self.log_debug(f'{self.img_type} thumbnail begin found at line {index}')
-                elif self.img_encoded_begin is not None and self.img_encoded_end is None and line.startswith(img_end_token):
+                self.parse_line(index, line)
+                if self.img_encoded_end is None or line.startswith(';') or not line.strip():
+                    # All thumbnails are in the comments at the beginning, every one is indexed
+                    continue
+                if footer_complete:
+                    self.log_debug(f'Thumbnail end found at line {index}, the rest is taken from footer')
+                    head_only = True
+                    break
+                if self.print_duration is not None and self.filament_cost is not None and self.filament_used_length is not None and self.filament_used_weight is not None:
+                    break
+        self.lines_parsed += index + 1
+
+        if self.thumbnails:
+            offsets = line_offsets(self.input_file, [i for block in self.thumbnails for i in (block.begin + 1, block.end) if i is not None])
+            for block in self.thumbnails:
+                block.offset = offsets[block.begin + 1]
+                block.length = offsets[block.end] - block.offset
+
+        if head_only and 'max_height' not in footer:
+            self.log_debug('Scanning file for max height')
+            self.max_height = max(self.max_height, lib_gcode.scan_gcode(self.input_file).max_height())
+
+        for attr, value in footer.items():
+            if attr == 'max_height':
+                self.max_height = max(self.max_height, value)
+            else:
+                setattr(self, attr, value)
+
+        self.parse_check()
+
+
+    @timed_stage
+    def read_footer(self) -> tuple:
+        """
+        Read print summary & the last layer height from the end of file (going backwards till the last ';Z:')
+        """
+        footer = {}
+        complete = False
+        sequential = False
+        with open(self.input_file, 'rb') as input:
+            for line in reversed_lines(input, FOOTER_MAX_SIZE):
+                line = line.decode('utf8', errors='replace')
+                if line.startswith(';Z:'):
+                    footer['max_height'] = float(line[3:].split(':')[0].strip())
+                    complete = True
+                    break
+                if 'complete_objects = 1' in line or 'print_sequence = by object' in line:
+                    sequential = True
+                for (key, attr, name) in summary_keys:
+                    if key in line:
+                        if attr not in footer:
+                            footer[attr] = extract_value(line, key)
+                            self.log_debug(f'{name} "{footer[attr]}" found in footer')
+                        break
+
+        if sequential:
+            # Objects are printed one by one so the last layer is not necessarily the highest one
+            footer.pop('max_height', None)
+        if 'max_height' in footer:
+            self.log_debug(f'The last layer height {footer["max_height"]} found in footer')
+        return (footer, complete)
+
+
+    def parse_line(self, index, line):
+        """
+        Collect metadata & thumbnail from one g-code line
+        """
+        if line.startswith('; generated by '):
+            self.header = line
+            self.header_line = index
+            self.log_debug(f'"generated by" found at line {index}')
+            return
+        for (key, attr, name) in summary_keys:
+            if key in line:
+                setattr(self, attr, extract_value(line, key))
+                self.log_debug(f'{name} "{getattr(self, attr)}" found at line {index}')
+                return
+        if line.startswith(';Z:'):
+            value = line.split(':')
+            height = float(value[1].strip())
+            if height > self.max_height:
+                self.max_height = height
+        elif line.startswith('; thumbnail'):
+            m = thumbnail_regex.match(line)
+            if m is None:
+                return
+            block = self.thumbnail_open
+            if m.group('state') == 'begin' and m.group('width') is not None:
+                block = ThumbnailBlock(int(m.group('width')), int(m.group('height')), m.group('format') or 'PNG', index)
+                if self.decode_thumbnail_lines:
+                    block.decoder = Base64Decoder()
+                self.thumbnails.append(block)
+                self.thumbnail_open = block
+                self.log_debug(f'{block.format} thumbnail {block.width}x{block.height} begin found at line {index}')
+                self.select_thumbnail(block)
+            elif m.group('state') == 'end' and block is not None and (m.group('format') or 'PNG') == block.format:
+                block.end = index
+                if block.decoder is not None:
+                    block.data = block.decoder.result()
+                    block.decoder = None
+                if block is self.thumbnail:
                     self.img_encoded_end = index
-                    self.log_debug(f'{self.img_type} thumbnail end found at line {index}')
-                elif self.img_encoded_begin is not None and self.img_encoded_end is None:
-                    self.img_encoded += line.strip('; ')
-                if self.print_duration is not None and self.filament_cost is not None and self.filament_used_length is not None and self.filament_used_weight is not None and self.img_encoded_begin is not None and self.img_encoded_end is not None:
-                    return
+                self.thumbnail_open = None
+                self.log_debug(f'{block.format} thumbnail {block.width}x{block.height} end found at line {index}')
+        elif self.thumbnail_open is not None and self.thumbnail_open.decoder is not None:
+            self.thumbnail_open.decoder.write(line.encode('ascii'))
 
-            if img_size is not None:
-                # Show error cause by "thumbnail not found" only if size was specified in options
-                if self.img_encoded_begin is None:
-                    raise Exception(f'Thumbnail begin not found in {self.input_file}')
-                if self.img_encoded_begin is not None and self.img_encoded_end is None:
-                    raise Exception(f'Thumbnail end not found in {self.input_file}')
+
+    def select_thumbnail(self, block):
+        """
+        Make block the thumbnail that is replaced by Klipper image if it is the first one larger than 100x100
+        or the one of requested size
+        """
+        size = f'{block.width}x{block.height}'
+        if self.thumbnail is not None or not ((self.img_size is None and block.width >= 100 and block.height >= 100) or size == self.img_size):
+            return
+        self.thumbnail = block
+        self.img_size = size
+        self.img_width = block.width
+        self.img_height = block.height
+        self.img_encoded_begin = block.begin
+        self.img_type = block.format
+
+
+    def thumbnail_source(self, size: int) -> ThumbnailBlock:
+        """
+        Thumbnail to render image of given size from: the smallest one not smaller than the size (the least resampling
+        work and quality loss) or the biggest one when all are smaller. Thumbnail of requested size is always used
+        """
+        if self.img_size_requested is not None:
+            return self.thumbnail
+        blocks = [block for block in self.thumbnails if block.end is not None or block.data is not None]
+        larger = [block for block in blocks if block.width >= size and block.height >= size]
+        if larger:
+            return min(larger, key=lambda block: (block.width * block.height, block is not self.thumbnail))
+        return max(blocks, key=lambda block: (block.width * block.height, block is self.thumbnail), default=self.thumbnail)
 
 
+    @timed_stage
+    def thumbnail_data(self, block: ThumbnailBlock) -> bytes:
+        """
+        Image data of thumbnail, base64 text is decoded straight from its byte range of input file
+        """
+        if block.data is None:
+            if block.end is None:
+                raise Exception(f'Thumbnail end not found in {self.input_file}')
+            self.log_debug(f'Decoding {block.format} thumbnail {block.width}x{block.height} from {block.length} bytes at offset {block.offset}')
+            decoder = Base64Decoder()
+            with open(self.input_file, 'rb') as input:
+                input.seek(block.offset)
+                copy_bytes(input, decoder, block.length)
+            block.data = decoder.result()
+        return block.data
+
+
+    def parse_check(self):
+        if self.img_size_requested is not None:
+            # Show error cause by "thumbnail not found" only if size was specified in options
+            if self.img_encoded_begin is None:
+                raise Exception(f'Thumbnail begin not found in {self.input_file}')
+            if self.img_encoded_begin is not None and self.img_encoded_end is None:
+                raise Exception(f'Thumbnail end not found in {self.input_file}')
+
+
+    @timed_stage
     def prepare(self):
         if self.print_duration is not None:
             if self.print_duration_short_format:
@@ -196,24 +794,37 @@ class Neptune_Thumbnail:
             self.max_height_formatted = '{:.1f}'.format(round(self.max_height, 1)) + 'mm'
 
 
-    def image_decode(self, text) -> Image:
+    @timed_stage
+    def image_decode(self, data: bytes, img_type: str='PNG', size=None) -> Image:
         """
-        Decodes base64 encoded image to QImage
+        Decodes image data of thumbnail to QImage with decoder of its format. JPG is decoded at reduced scale
+        (1/2, 1/4 or 1/8) when it is still at least size, QOI is decoded by lib_qoi
         """
-        if not text:
-            raise Exception('Thumbnail text is empty')
+        if not data:
+            raise Exception('Thumbnail is empty')
+
+        self.log_debug(f'Decoding {img_type} thumbnail image')
+        from PIL import Image
 
-        self.log_debug('Decoding thumbnail from base64')
-        text_bytes = text.encode('ascii')
-        decode_data = base64.b64decode(text_bytes)
-        image_stream = BytesIO(decode_data)
-        img = Image.open(image_stream).convert('RGBA')
+        if img_type == 'QOI':
+            (width, height, _, pixels) = lib_qoi.decode(data)
+            img = Image.frombuffer('RGBA', (width, height), pixels, 'raw', 'RGBA', 0, 1)
+        else:
+            img = Image.open(BytesIO(data), formats=[PIL_FORMATS[img_type]])
+            if img_type == 'JPG' and size is not None:
+                # DCT scaling while decoding is much cheaper than resampling of full size image
+                full_size = img.size
+                img.draft('RGB', (size, size))
+                if img.size != full_size:
+                    self.log_debug(f'JPG thumbnail decoded at {img.width}x{img.height}')
+            img = img.convert('RGBA')
 
-        self.img_type_detected = 'PNG'
+        self.img_type_detected = img_type
 
         return img
 
 
+    @timed_stage
     def image_resize(self, img: Image, size) -> Image:
         """
         Resize image
@@ -222,29 +833,46 @@ class Neptune_Thumbnail:
             raise Exception('No image')
 
         if img.width == size:
-            return Image(img);
+            # Texts are drawn right into the result, so it must not be the source image
+            return img.copy()
+
+        from PIL import ImageOps
 
         self.log_debug(f'Scaling image to {size}x{size}')
         return ImageOps.scale(img, size/img.width)
 
 
-    def image_modify(self, img: Image, light_theme: bool=False) -> Image:
+    @timed_stage
+    def image_composite(self, img: Image, background) -> Image:
         """
-        Add texts to image
+        Composite transparent image on background color into RGB image
+        """
+        from PIL import Image
+
+        self.log_debug(f'Compositing image on background {background}')
+        result = Image.new('RGBA', img.size, background)
+        result.alpha_composite(img)
+        return result.convert('RGB')
+
+
+    @timed_stage
+    def image_modify(self, img: Image, light_theme: bool=False, background=None) -> Image:
+        """
+        Add texts to image (in place). Background is the color the image has been composited on, if any
         """
         if self.print_duration_formatted is None and self.max_height_formatted is None and self.filament_used_weight_formatted is None and self.filament_used_length_formatted is None:
             return img;
 
-        self.log_debug('Adding texts to image')
+        from PIL import Image, ImageDraw
 
-        img_copy = img.copy()
+        self.log_debug('Adding texts to image')
 
-        draw = ImageDraw.Draw(img_copy)
+        draw = ImageDraw.Draw(img)
 
         font_size = int(img.height / 14);
 
 
-        draw.font = ImageFont.truetype("Helvetica", font_size)
+        draw.font = get_font(font_size)
         draw.fontmode = "L"
 
         bgcolor = None
@@ -255,6 +883,12 @@ class Neptune_Thumbnail:
             color = (255, 255, 255, 255)
             bgcolor = (0, 0, 0, 128)
 
+        if background is not None:
+            # Semi-transparent text background as it would look composited on the background
+            bgcolor = Image.alpha_composite(Image.new('RGBA', (1, 1), background), Image.new('RGBA', (1, 1), bgcolor)).getpixel((0, 0))
+            color = color[:3]
+            bgcolor = bgcolor[:3]
+
         rect_top = [0, 0, img.width, font_size]
         rect_bottom = [0, img.height-font_size, img.width, img.height]
         self.log_debug(rect_bottom)
@@ -266,93 +900,56 @@ class Neptune_Thumbnail:
         if self.print_duration_formatted is not None:
             draw.text((rect_top[0], rect_top[1]), self.print_duration_formatted, fill=color)
         if self.max_height_formatted is not None:
-            length = draw.textlength(self.max_height_formatted)
+            length = get_text_length(draw, self.max_height_formatted, font_size)
             draw.text((rect_top[2]-length, rect_top[1]), self.max_height_formatted, fill=color)
         if self.filament_used_weight_formatted is not None:
             draw.text((rect_bottom[0], rect_bottom[1]), self.filament_used_weight_formatted, fill=color)
         if self.filament_used_length_formatted is not None:
-            length = draw.textlength(self.filament_used_length_formatted)
+            length = get_text_length(draw, self.filament_used_length_formatted, font_size)
             draw.text((rect_bottom[2]-length, rect_bottom[1]), self.filament_used_length_formatted, fill=color)
 
         if self.debug:
-            img_type = self.img_type
-            if img_type is None:
-                img_type = 'PNG'
-            img_copy.save(path.join(script_dir, 'img-' + str(img.width) + 'x' + str(img.height) + '.' + img_type.lower()))
+            # PNG keeps alpha channel & texts as they are drawn
+            img.save(path.join(script_dir, 'img-' + str(img.width) + 'x' + str(img.height) + '.png'))
 
-        return img_copy
+        return img
 
 
-    def image_encode(self, img: Image, prefix) -> str:
+    @timed_image_stage
+    def image_encode(self, img: Image, prefix, output):
         """
-        Encode image for old printers
+        Encode image for old printers (RGB565 little-endian hex) and write it into output row by row
         """
         if img is None:
             raise Exception('No image')
 
         self.log_debug(f'Encoding image for old printers ({prefix})')
-        result = ''
-        width = img.width
-        height = img.height
-        result += prefix
-        datasize = 0
-        for i in range(height):
-            for j in range(width):
-                pixel_color = img.pixelColor(j, i)
-                r = pixel_color.red() >> 3
-                g = pixel_color.green() >> 2
-                b = pixel_color.blue() >> 3
-                rgb = (r << 11) | (g << 5) | b
-                str_hex = '%x' % rgb
-                match len(str_hex):
-                    case 3:
-                        str_hex = '0' + str_hex[0:3]
-                    case 2:
-                        str_hex = '00' + str_hex[0:2]
-                    case 1:
-                        str_hex = '000' + str_hex[0:1]
-                if str_hex[2:4] != '':
-                    result += str_hex[2:4]
-                    datasize += 2
-                if str_hex[0:2] != '':
-                    result += str_hex[0:2]
-                    datasize += 2
-                if datasize >= 50:
-                    datasize = 0
-            result += '\rM10086 ;'
-            if i == height - 1:
-                result += '\r'
-        return result
+        data = rgb565_le(img)
+        row_size = img.width * 2
+        output.write(prefix)
+        for pos in range(0, len(data), row_size):
+            output.write(data[pos:pos + row_size].hex() + '\rM10086 ;')
+        output.write('\r')
 
 
+    @timed_image_stage
     def image_encode_new(self, img: Image, prefix) -> str:
         """
-        Encode image for new printers
+        Encode image for new printers (already composited on background)
         """
         if img is None:
             raise Exception('No image to encode')
 
+        import lib_col_pic
+
         self.log_debug(f'Encoding image for new printers ({prefix})')
 
         result   = ''
         width    = img.width
         height   = img.height
-        background = Image.new('RGBA', img.size, (46,51,72))
-        alpha_composite = Image.alpha_composite(background, img)
-        b_image = alpha_composite.resize((width, height))
-        pixels = b_image.load()
-        img_size = (width, height)
-        color16 = array('H')
 
         try:
-            for i in range(height):
-                for j in range(width):
-                    pixel_color = pixels[j, i]
-                    r = pixel_color[0] >> 3
-                    g = pixel_color[1] >> 2
-                    b = pixel_color[2] >> 3
-                    rgb = (r << 11) | (g << 5) | b
-                    color16.append(rgb)
+            color16 = rgb565_le(img)
 
             buffer_size       = height * width * 10
             buffer            = bytearray(buffer_size)
@@ -361,52 +958,11 @@ class Neptune_Thumbnail:
             if encoded_size <= 0:
                 raise Exception(f'Nothing encoded')
 
+            # ListDataSize from the header (the first 44 chars are 33 bytes)
+            header = lib_col_pic.ColPicUnpackStr(buffer[:44])
+            self.palette_colors[prefix.strip(';:')] = int.from_bytes(header[16:20], 'little') // 2
 
-            data0 = str(buffer).replace('\\x00', '')
-            data1 = data0[2:len(data0) - 2]
-            each_max = 1024 - 8 - 1
-            max_line = int(len(data1) / each_max)
-            append_len = each_max - 3 - int(len(data1) % each_max) + 10
-            j = 0
-            for i in range(len(buffer)):
-                if buffer[i] != 0:
-                    if j == max_line * each_max:
-                        result += '\r;' + prefix + chr(buffer[i])
-                    elif j == 0:
-                        result += prefix + chr(buffer[i])
-                    elif j % each_max == 0:
-                        result += '\r' + prefix + chr(buffer[i])
-                    else:
-                        result += chr(buffer[i])
-                    j += 1
-            result += '\r;'
-            for m in range(append_len):
-                result += '0'
-
-            # prefix_len        = len(prefix)
-            # max_line_len      = 1024
-            # max_line_data_len = max_line_len - prefix_len - 1
-
-            # data              = buffer[:encoded_size]
-            # data_len          = len(data)
-            # lines_count       = int(data_len / max_line_data_len)
-            # append_len        = max_line_data_len - 3 - int(data_len % max_line_data_len)
-            #
-            # #logger.debug(f'image_encode_new: encoded_size={encoded_size} data_len={data_len} lines_count={lines_count} append_len={append_len}')
-            # #logger.debug(f'buffer={str(buffer)}')
-            # #logger.debug(f'  data={str(data)}')
-            #
-            # for i in range(data_len):
-            #     if i % max_line_data_len == 0:
-            #         if i > 0:
-            #             result += '\r'
-            #             if i == lines_count * max_line_data_len:
-            #                 # last line should be ';;gimage:', instead of ';gimage:'
-            #                 result += ';'
-            #         result += prefix
-            #     result += chr(data[i])
-            #
-            # result += '\r;' + ('0' * append_len)
+            result = colpic_frame(memoryview(buffer)[:encoded_size], prefix)
 
         except Exception:
             logger.exception('Failed to encode new thumbnail')
@@ -414,108 +970,764 @@ class Neptune_Thumbnail:
         return result + '\r'
 
 
+    @timed_stage
     def image_encode_klipper(self, img: Image, img_type: str, base64_block_len: int) -> str:
         """
-        Generate image in original Klipper format (base64 with prefix & suffix)
+        Generate image in original Klipper format (base64 with prefix & suffix), image format of the thumbnail is kept
         """
-        result: str = '\n'
         byte_buffer = BytesIO()
-        img.save(byte_buffer, img_type)
+        if img_type == 'JPG':
+            # Semi-transparent text background would be black when alpha is dropped
+            img = self.image_composite(img.convert('RGBA'), KLIPPER_BACKGROUND_LIGHT if self.original_image_light_theme else KLIPPER_BACKGROUND_DARK)
+        try:
+            img.save(byte_buffer, PIL_FORMATS[img_type])
+        except KeyError:
+            # Pillow writes QOI since 11.3
+            self.log_debug(f'{img_type} images can not be written by installed Pillow, Klipper image is written as PNG')
+            img_type = 'PNG'
+            img.save(byte_buffer, img_type)
         base64_str: str = base64.b64encode(byte_buffer.getvalue()).decode('ascii')
-        base64_len: int = len(base64_str)
-        result += f'; thumbnail begin {img.width}x{img.height} {base64_len}\n'
-        pos: int = 0
-        while pos < base64_len:
-            result += f'; {base64_str[pos:pos+base64_block_len]}\n'
-            pos += base64_block_len
-        result += f'; thumbnail end\n\n'
-        return result
+        return thumbnail_text(base64_str, img.width, img.height, thumbnail_tag(img_type), base64_block_len)
+
 
+    @timed_stage
+    def image_blocks(self, output) -> str:
+        """
+        Write encoded images into output in the order they are written and return Klipper image (None when it is not
+        updated). Cached images are copied from the cache, images for old printers are written row by row.
+        Every image is rendered from the closest thumbnail of g-code, Klipper image replaces the selected one
+        """
+        import contextlib
+        import shutil
+
+        if self.run_old_printer:
+            sizes = {';simage:': 100, ';gimage:': 200}
+        else:
+            sizes = {';gimage:': 200, ';simage:': 160}
+        texts = (self.print_duration_formatted, self.max_height_formatted, self.filament_used_weight_formatted, self.filament_used_length_formatted)
+
+        keys = {prefix: ('old' if self.run_old_printer else 'new', prefix, size, texts) for (prefix, size) in sizes.items()}
+        if self.update_original_image:
+            keys[None] = ('klipper', self.original_image_light_theme, self.img_base64_block_len, texts)
+
+        sources = {prefix: self.thumbnail_source(size) for (prefix, size) in sizes.items()}
+        sources[None] = self.thumbnail
+        for prefix in sizes:
+            self.log_debug(f'{prefix} image is rendered from {sources[prefix].format} thumbnail {sources[prefix].width}x{sources[prefix].height}')
+
+        cached = dict.fromkeys(keys)
+        if self.cache is not None:
+            import lib_cache
+            keys = {name: lib_cache.cache_key(self.thumbnail_data(sources[name]), *key) for (name, key) in keys.items()}
+            for name in keys:
+                cached[name] = self.cache.open_entry(keys[name])
+            self.log_debug(f'Image cache: {self.cache.hits} hits, {self.cache.misses} misses')
+
+        try:
+            missing = [name for name in cached if cached[name] is None]
+            # Every thumbnail is decoded once, at the scale the largest image rendered from it needs (Klipper image needs full size)
+            decode_sizes = {}
+            for name in missing:
+                source = sources[name]
+                size = sizes[name] if name is not None else max(source.width, source.height)
+                decode_sizes[source] = max(decode_sizes.get(source, 0), size)
+            images = {source: self.image_decode(self.thumbnail_data(source), source.format, size) for (source, size) in decode_sizes.items()}
+
+            masters = {}
+            for prefix in sizes:
+                source = sources[prefix]
+                if cached[prefix] is not None:
+                    block = BlockWriter(output)
+                    shutil.copyfileobj(cached[prefix], block)
+                elif self.run_old_printer:
+                    # Old printer images are big, so they are written into output & cache entry row by row
+                    with self.cache.writer(keys[prefix]) if self.cache is not None else contextlib.nullcontext() as entry:
+                        block = BlockWriter(output, entry)
+                        self.image_encode(self.image_modify(self.image_resize(images[source], sizes[prefix])), prefix, block)
+                else:
+                    if source not in masters:
+                        # Composited once per thumbnail, every size is resampled from it and texts are drawn right into the result
+                        masters[source] = self.image_composite(images[source], NEPTUNE_BACKGROUND)
+                    text = self.image_encode_new(self.image_modify(self.image_resize(masters[source], sizes[prefix]), background=NEPTUNE_BACKGROUND), prefix)
+                    block = BlockWriter(output)
+                    block.write(text)
+                    # Failed encoding is not cached
+                    if self.cache is not None and text.strip():
+                        self.cache.put(keys[prefix], text)
+                self.block_bytes[prefix.strip(';:')] = block.size
+
+            if None not in keys:
+                return None
+            if cached[None] is not None:
+                klipper = cached[None].read()
+            else:
+                # The last use of decoded image, so texts are drawn right into it
+                klipper = self.image_encode_klipper(self.image_modify(images[self.thumbnail], self.original_image_light_theme), self.thumbnail.format, self.img_base64_block_len)
+                if self.cache is not None:
+                    self.cache.put(keys[None], klipper)
+            self.block_bytes['klipper'] = len(klipper)
+            return klipper
+        finally:
+            for input in cached.values():
+                if input is not None:
+                    input.close()
+
+
+    @timed_stage
+    def write_header(self, output):
+        """
+        Decode & encode thumbnail and write new header into output
+        """
+        # Adding image at the very beginning as some reports that comments before image breaks it on some neptune printers.
+        # Binary g-code is converted even without thumbnail
+        self.img_klipper = self.image_blocks(output) if self.thumbnail is not None else None
+
+        header = ' \n\n; Thumbnail Generated by ElegooNeptuneThumbnailPrusaMod\n'
+        # seeing if this works for N4 printer thanks to Molodos: https://github.com/Molodos/ElegooNeptuneThumbnails-Prusa
+        header += '; Just mentioning Cura_SteamEngine X.X to trick printer into thinking this is Cura\n\n'
+
+        header += self.header.replace('PrusaSlicer', self.prusa_mask).replace('OrcaSlicer', self.orca_mask)
+        header += '\n\n'
+
+        output.write(header)
+
+
+    def rewrite_line(self, index, line, output):
+        """
+        Copy g-code line into output: "generated by" line and original thumbnail are skipped, print progress is added
+        """
+        if index == self.header_line:
+            return
+        if self.update_original_image and self.img_encoded_begin is not None and index >= self.img_encoded_begin and (self.img_encoded_end is None or index <= self.img_encoded_end):
+            return
+        if self.time_elapsed is not None and line.startswith(';LAYER_CHANGE'):
+            output.write(';TIME_ELAPSED:' + str(self.time_elapsed) + '\n');
+        if line.startswith('M73 P'):
+            # Converting 'M73 P<percentage-completed> R<time-left-in-minutes>' to ';TIME:<print-duration-in-seconds>' + ';TIME_ELAPSED:<time-elapsed-in-seconds>'
+            (percentage, time_to_end) = line[5:].split(' R')
+            t = int(time_to_end) * 60
+            if self.total_duration is None:
+                self.total_duration = t
+                output.write(';TIME:' + str(self.total_duration) + '\n')
+                self.log_debug(f'Progress: {percentage}% complete (total duration: {t} seconds)')
+            else:
+                self.time_elapsed = self.total_duration - t
+                self.log_debug(f'Progress: {percentage}% complete, {self.time_elapsed} seconds passed')
+        output.write(line)
 
+
+    @timed_stage
+    def replace_input(self, output_file, target_file=None):
+        if target_file is None:
+            target_file = self.input_file
+        if path.isfile(output_file):
+            self.output_size = path.getsize(output_file)
+            self.log_debug(f'Renaming file {output_file} to {target_file}')
+            replace(output_file, target_file)
+        else:
+            raise Exception(f'File {output_file} does not exists')
+
+        output_name = os.environ.get('SLIC3R_PP_OUTPUT_NAME')
+        if output_name is not None and self.output_name(output_name) != output_name:
+            # Read by slicer after the script completed
+            with open(self.input_file + '.output_name', 'w', encoding='utf8') as output:
+                output.write(self.output_name(output_name))
+
+        self.log_debug('G-code file modification completed')
+
+
+    def output_name(self, file_name) -> str:
+        return converted_name(file_name, self.input_binary, self.input_compression, self.output_compression)
+
+
+    def output_target(self) -> str:
+        """
+        File the result is saved to: input file itself or, when the result is binary g-code converted into text one or
+        compressed differently, a new file next to it. Slicer runs post-processing scripts on temporary file, so it is
+        always replaced (slicer is asked to save it under the new name)
+        """
+        if os.environ.get('SLIC3R_PP_OUTPUT_NAME') is not None:
+            return self.input_file
+        return self.output_name(self.input_file)
+
+
+    def open_input(self):
+        """
+        Binary stream of input file content (decompressed on the fly)
+        """
+        return lib_compress.open_input(self.input_file, self.input_compression)
+
+
+    def open_output(self, output_file):
+        """
+        Binary stream writing into output file (compressed on the fly)
+        """
+        return lib_compress.open_output(output_file, self.output_compression, self.compression_level, self.compression_threads)
+
+
+    @timed_stage
     def run(self):
         """
         Main runner for executable
         """
+        self.input_size = path.getsize(self.input_file)
+        with open(self.input_file, 'rb') as input:
+            head = input.read(max(len(lib_bgcode.MAGIC), lib_compress.MAGIC_MAX_SIZE))
+        self.input_binary = head.startswith(lib_bgcode.MAGIC)
+        self.input_compression = lib_compress.detect(head)
+        if self.output_compression_requested is None:
+            self.output_compression = self.input_compression
+        elif self.output_compression_requested != 'none':
+            self.output_compression = self.output_compression_requested
+        if self.input_compression is not None:
+            self.log_debug(f'Input file is {self.input_compression} compressed')
+
+        if self.input_binary:
+            self.run_bgcode()
+            return
+        if self.single_pass:
+            self.run_single_pass()
+            return
+        if self.input_compression is not None:
+            self.run_stream()
+            return
+
         self.parse()
 
         self.prepare()
 
-        if not self.img_encoded:
-            logger.info('Thumbnail not found in g-code')
+        if self.thumbnail is None:
+            self.log_debug('Thumbnail not found in g-code')
             return;
 
         self.log_debug('Modifying g-code file')
 
-        img = self.image_decode(self.img_encoded)
-        img_200x200 = self.image_modify(self.image_resize(img, 200))
-        if self.update_original_image:
-            img_klipper = self.image_encode_klipper(self.image_modify(img, self.original_image_light_theme), self.img_type_detected, self.img_base64_block_len)
+        target_file = self.output_target()
+        output_file = target_file + '.output'
+        try:
+            with open(self.input_file, 'rb') as input, self.open_output(output_file) as output:
+                newline = '\r\n' if input.readline().endswith(b'\r\n') else '\n'
+                input.seek(0)
+                self.log_debug(f'Writing new header with image into file {output_file}')
+                header = TextIOWrapper(output, encoding='utf8', newline=newline)
+                self.write_header(header)
+                header.detach()
+                self.rewrite_body(input, output, newline)
+        except BaseException:
+            # Thumbnail is decoded & encoded only while the header is written
+            if path.exists(output_file):
+                os.remove(output_file)
+            raise
+
+        self.replace_input(output_file, target_file)
+
+
+    def metrics(self) -> dict:
+        """
+        Stage timings and sizes of the run
+        """
+        return {
+            'stages': {stage: {'wall': wall, 'cpu': self.cpu_timings.get(stage, 0.0)} for (stage, wall) in self.timings.items()},
+            'input_bytes': self.input_size,
+            'output_bytes': self.output_size,
+            'lines_parsed': self.lines_parsed,
+            'palette_colors': self.palette_colors,
+            'block_bytes': self.block_bytes,
+            'cache_hits': self.cache.hits if self.cache is not None else None,
+            'cache_misses': self.cache.misses if self.cache is not None else None,
+        }
+
+
+    @timed_stage
+    def rewrite_body(self, input, output, newline):
+        """
+        Copy input into output applying edits, unchanged ranges are copied by OS when possible
+        """
+        edits = self.rewrite_edits()
+        self.log_debug(f'Copying content from file {self.input_file} ({len(edits)} edits)')
+        # Compressed output has to go through the compressor
+        methods = zero_copy_methods() if self.output_compression is None else []
+        pos = 0
+        for (offset, length, text) in edits:
+            copy_range(input, output, pos, offset - pos, methods)
+            if text:
+                output.write(text.replace('\n', newline).encode('utf8'))
+            pos = offset + length
+        copy_range(input, output, pos, fstat(input.fileno()).st_size - pos, methods)
+
+
+    def rewrite_edits(self) -> list:
+        """
+        Differences between input and output file as (offset, length of removed bytes, inserted text) sorted by offset
+        """
+        removed = []
+        if self.header_line is not None:
+            removed.append((self.header_line, self.header_line + 1, ''))
+        if self.update_original_image and self.img_encoded_begin is not None:
+            removed.append((self.img_encoded_begin, None if self.img_encoded_end is None else self.img_encoded_end + 1, self.img_klipper))
 
-        header = ''
+        offsets = line_offsets(self.input_file, [index for (begin, end, _) in removed for index in (begin, end) if index is not None])
+        edits = []
+        for (begin, end, text) in removed:
+            edits.append((offsets[begin], offsets.get(end, offsets[None]) - offsets[begin], text))
 
-        # Adding image at the very beginning as some reports that comments before image breaks it on some neptune printers
-        if self.run_old_printer:
-            header += self.image_encode(self.image_modify(self.image_resize(img, 100)), ';simage:')
-            header += self.image_encode(img_200x200, ';gimage:')
-        else:
-            header += self.image_encode_new(img_200x200, ';gimage:')
-            header += self.image_encode_new(self.image_modify(self.image_resize(img, 160)), ';simage:')
+        for (offset, text) in lib_gcode.scan_gcode(self.input_file).progress_edits():
+            if not any(o <= offset < o + length for (o, length, _) in edits[:len(removed)]):
+                edits.append((offset, 0, text))
 
-        header += ' \n\n; Thumbnail Generated by ElegooNeptuneThumbnailPrusaMod\n'
-        # seeing if this works for N4 printer thanks to Molodos: https://github.com/Molodos/ElegooNeptuneThumbnails-Prusa
-        header += '; Just mentioning Cura_SteamEngine X.X to trick printer into thinking this is Cura\n\n'
+        edits.sort(key=lambda edit: edit[0])
+        return edits
 
-        header += self.header.replace('PrusaSlicer', self.prusa_mask).replace('OrcaSlicer', self.orca_mask)
-        header += '\n\n'
 
-        output_file = self.input_file + '.output'
-        with open(self.input_file, 'r', encoding='utf8') as input, open(output_file, 'w', encoding='utf8') as output:
-            self.log_debug(f'Writing new header with image into file {output_file}')
-            output.write(header)
-            self.log_debug(f'Copying content from file {self.input_file} to file {output_file}')
-            time_elapsed = None
-            total_duration = None
+    @timed_stage
+    def run_single_pass(self):
+        """
+        Read input file only once: content is parsed and rewritten into temporary file, header is added when everything is known
+        """
+        import shutil
+        import tempfile
+
+        self.log_debug('Parsing and rewriting file in single pass')
+
+        target_file = self.output_target()
+        output_file = target_file + '.output'
+        img_offset = None
+        index = -1
+        input = self.open_input()
+        # Lines are parsed with '\n' line breaks, line break of the file is written back the way rewrite_body() does it
+        head = input.peek()
+        newline = '\r\n' if head[:head.find(b'\n') + 1].endswith(b'\r\n') else '\n'
+        with TextIOWrapper(input, encoding='utf8') as input, tempfile.TemporaryFile(dir=path.dirname(path.abspath(output_file))) as spool:
+            body = TextIOWrapper(spool, encoding='utf8', newline=newline)
             for index, line in enumerate(input):
-                if index == self.header_line:
-                    continue
-                if self.update_original_image:
-                    if index > self.img_encoded_begin and index <= self.img_encoded_end:
-                        continue
-                    if index == self.img_encoded_begin:
-                        output.write(img_klipper)
-                        continue
-                if time_elapsed is not None and line.startswith(';LAYER_CHANGE'):
-                    output.write(';TIME_ELAPSED:' + str(time_elapsed) + '\n');
-                if line.startswith('M73 P'):
-                    # Converting 'M73 P<percentage-completed> R<time-left-in-minutes>' to ';TIME:<print-duration-in-seconds>' + ';TIME_ELAPSED:<time-elapsed-in-seconds>'
-                    (percentage, time_to_end) = line[5:].split(' R')
-                    t = int(time_to_end) * 60
-                    if total_duration is None:
-                        total_duration = t
-                        output.write(';TIME:' + str(total_duration) + '\n')
-                        self.log_debug(f'Progress: {percentage}% complete (total duration: {t} seconds)')
-                    else:
-                        time_elapsed = total_duration - t
-                        self.log_debug(f'Progress: {percentage}% complete, {time_elapsed} seconds passed')
-                output.write(line)
+                self.parse_line(index, line)
+                if img_offset is None and index == self.img_encoded_begin:
+                    body.flush()
+                    img_offset = spool.tell()
+                self.rewrite_line(index, line, body)
+            body.flush()
+            self.lines_parsed += index + 1
+            self.parse_check()
+
+            self.prepare()
+
+            if self.thumbnail is None:
+                self.log_debug('Thumbnail not found in g-code')
+                return;
+
+            self.log_debug('Modifying g-code file')
+
+            try:
+                with TextIOWrapper(self.open_output(output_file), encoding='utf8', newline=newline) as output:
+                    self.log_debug(f'Writing new header with image into file {output_file}')
+                    self.write_header(output)
+                    self.log_debug(f'Copying content from temporary file to file {output_file}')
+                    spool.seek(0)
+                    if self.update_original_image and img_offset is not None:
+                        output.flush()
+                        copy_bytes(spool, output.buffer, img_offset)
+                        output.write(self.img_klipper)
+                    output.flush()
+                    shutil.copyfileobj(spool, output.buffer, COPY_BUFFER_SIZE)
+            except BaseException:
+                # Thumbnail is decoded & encoded only while the header is written
+                if path.exists(output_file):
+                    os.remove(output_file)
+                raise
+
+        self.replace_input(output_file, target_file)
+
+
+    @timed_stage
+    def parse_stream(self) -> str:
+        """
+        Collect metadata & thumbnail from compressed file: it can not be read from the end, so the whole content is
+        decompressed in chunks and parse_line() is called for comment lines only. Returns line break used in the file
+        """
+        self.log_debug('Parsing compressed file')
+
+        newline = '\n'
+        index = 0
+        with self.open_input() as input:
+            for chunk in read_chunks(input):
+                if index == 0:
+                    newline = '\r\n' if chunk[:chunk.find(b'\n') + 1].endswith(b'\r\n') else '\n'
+                for (line_index, start, end, line) in chunk_lines(b';', chunk):
+                    self.parse_line(index + line_index, line)
+                index += chunk_lines_qty(chunk)
+        self.lines_parsed += index
+        self.parse_check()
+        return newline
+
+
+    @timed_stage
+    def rewrite_stream(self, input, output, newline):
+        """
+        Copy decompressed input into output applying rewrite_line(): lines up to the last removed one go through it one by one,
+        after them only print progress lines do and the rest is copied in chunks as it is
+        """
+        writer = EncodingWriter(output, newline)
+        last_removed = -1 if self.header_line is None else self.header_line
+        if self.update_original_image and self.img_encoded_begin is not None:
+            last_removed = max(last_removed, float('inf') if self.img_encoded_end is None else self.img_encoded_end)
+
+        index = 0
+        for chunk in read_chunks(input):
+            start = 0
+            if index <= last_removed:
+                for m in line_regex.finditer(chunk):
+                    if self.update_original_image and index == self.img_encoded_begin:
+                        writer.write(self.img_klipper)
+                    self.rewrite_line(index, decode_line(m.group()), writer)
+                    index += 1
+                    start = m.end()
+                    if index > last_removed:
+                        break
+            view = memoryview(chunk)
+            pos = start
+            for (line_index, line_start, line_end, line) in chunk_lines(progress_line_pattern, chunk, start):
+                output.write(view[pos:line_start])
+                self.rewrite_line(index + line_index, line, writer)
+                pos = line_end
+            output.write(view[pos:])
+            index += chunk_lines_qty(chunk, start)
+
+
+    @timed_stage
+    def run_stream(self):
+        """
+        Compressed input can not be read from the end or copied by ranges, so it is decompressed twice: for metadata and
+        while output is written. Both passes go in chunks of whole lines, nothing is kept in temporary file
+        """
+        newline = self.parse_stream()
 
-        if path.isfile(output_file):
-            self.log_debug(f'Renaming file {output_file} to {self.input_file}')
-            replace(output_file, self.input_file)
+        self.prepare()
+
+        if self.thumbnail is None:
+            self.log_debug('Thumbnail not found in g-code')
+            return
+
+        self.log_debug('Modifying g-code file')
+
+        target_file = self.output_target()
+        output_file = target_file + '.output'
+        try:
+            with self.open_input() as input, self.open_output(output_file) as output:
+                self.log_debug(f'Writing new header with image into file {output_file}')
+                self.write_header(EncodingWriter(output, newline))
+                self.rewrite_stream(input, output, newline)
+        except BaseException:
+            # Broken compressed data is found only while it is rewritten
+            if path.exists(output_file):
+                os.remove(output_file)
+            raise
+
+        self.replace_input(output_file, target_file)
+
+
+    @timed_stage
+    def parse_bgcode(self, reader):
+        """
+        Read metadata & thumbnails of binary g-code, they precede g-code blocks that are not read here
+        """
+        self.log_debug('Parsing binary g-code file')
+
+        for block in reader.blocks():
+            if block.type == lib_bgcode.GCODE:
+                self.bgcode_gcode_offset = block.offset
+                break
+            if block.type == lib_bgcode.THUMBNAIL:
+                self.bgcode_thumbnails.append(block)
+            else:
+                self.bgcode_metadata[block.type] = lib_bgcode.parse_metadata(reader.read(block))
+
+        producer = self.bgcode_metadata.get(lib_bgcode.FILE_METADATA, {}).get('Producer')
+        if producer is not None:
+            self.header = f'; generated by {producer}\n'
+
+        for (key, attr, name) in summary_keys:
+            for block_type in (lib_bgcode.PRINT_METADATA, lib_bgcode.PRINTER_METADATA):
+                value = self.bgcode_metadata.get(block_type, {}).get(key.rstrip(' ='))
+                if value is not None:
+                    setattr(self, attr, value)
+                    self.log_debug(f'{name} "{value}" found in metadata')
+                    break
+
+        max_layer_z = self.bgcode_metadata.get(lib_bgcode.PRINTER_METADATA, {}).get('max_layer_z')
+        if max_layer_z is not None:
+            self.max_height = float(max_layer_z)
+            self.log_debug(f'Max height {self.max_height} found in metadata')
+
+        for block in self.bgcode_thumbnails:
+            (img_format, width, height) = block.params
+            thumbnail = ThumbnailBlock(width, height, lib_bgcode.THUMBNAIL_FORMATS[img_format])
+            # Thumbnails are small, every one is needed for the output anyway
+            thumbnail.data = reader.read(block)
+            self.thumbnails.append(thumbnail)
+            self.log_debug(f'{thumbnail.format} thumbnail {width}x{height} found at offset {block.offset}')
+            self.select_thumbnail(thumbnail)
+
+        if self.img_size_requested is not None and self.thumbnail is None:
+            raise Exception(f'Thumbnail {self.img_size_requested} not found in {self.input_file}')
+
+
+    @timed_stage
+    def rewrite_bgcode_body(self, reader, output):
+        """
+        Write content of binary g-code the way slicer writes text g-code: printer metadata, thumbnails (with the Klipper one
+        replaced), g-code with print progress added (decompressed block by block), print summary & slicer config
+        """
+        printer_metadata = self.bgcode_metadata.get(lib_bgcode.PRINTER_METADATA, {})
+        output.write(''.join(f'; {key} = {value}\n' for (key, value) in printer_metadata.items()))
+
+        for block in self.thumbnails:
+            if block is self.thumbnail and self.update_original_image:
+                output.write(self.img_klipper)
+                continue
+            base64_str = base64.b64encode(block.data).decode('ascii')
+            output.write(thumbnail_text(base64_str, block.width, block.height, thumbnail_tag(block.format), self.img_base64_block_len))
+
+        index = -1
+        if self.bgcode_gcode_offset is not None:
+            for (index, line) in enumerate(reader.gcode(self.bgcode_gcode_offset)):
+                self.rewrite_line(index, line, output)
+        self.lines_parsed += index + 1
+
+        print_metadata = self.bgcode_metadata.get(lib_bgcode.PRINT_METADATA, {})
+        output.write('\n' + ''.join(f'; {key} = {value}\n' for (key, value) in print_metadata.items()))
+        slicer_metadata = self.bgcode_metadata.get(lib_bgcode.SLICER_METADATA, {})
+        if slicer_metadata:
+            output.write('\n; prusaslicer_config = begin\n' + ''.join(f'; {key} = {value}\n' for (key, value) in slicer_metadata.items()) + '; prusaslicer_config = end\n')
+
+
+    @timed_stage
+    def run_bgcode(self):
+        """
+        Convert binary g-code (.bgcode) into text g-code with thumbnail for Neptune printers. Metadata & thumbnail
+        are taken by jumping over block headers, only g-code blocks are decompressed while output is written
+        """
+        self.log_debug('Converting binary g-code file')
+
+        with open(self.input_file, 'rb') as input:
+            reader = lib_bgcode.BgcodeReader(input)
+            self.parse_bgcode(reader)
+
+            if self.max_height == 0 and self.bgcode_gcode_offset is not None:
+                self.log_debug('Scanning g-code blocks for max height')
+                for line in reader.gcode(self.bgcode_gcode_offset):
+                    if line.startswith(';Z:'):
+                        self.max_height = max(self.max_height, float(line[3:].split(':')[0].strip()))
+
+            self.prepare()
+
+            if self.thumbnail is None:
+                self.log_debug('Thumbnail not found in g-code, converting it into text g-code only')
+
+            target_file = self.output_target()
+            output_file = target_file + '.output'
+            try:
+                with TextIOWrapper(self.open_output(output_file), encoding='utf8', newline='\n') as output:
+                    self.log_debug(f'Writing new header with image into file {output_file}')
+                    self.write_header(output)
+                    self.rewrite_bgcode_body(reader, output)
+            except BaseException:
+                # Broken block is found only when it is decompressed
+                if path.exists(output_file):
+                    os.remove(output_file)
+                raise
+
+        self.replace_input(output_file, target_file)
+
+
+def expand_input_files(patterns) -> list:
+    """
+    Expand directories (into g-code files inside: text, binary & compressed) and glob patterns
+    """
+    import glob
+
+    result = []
+    for pattern in patterns:
+        if path.isdir(pattern):
+            files = sorted(file for file_pattern in GCODE_PATTERNS for file in glob.glob(path.join(glob.escape(pattern), file_pattern)))
+        elif path.exists(pattern):
+            files = [pattern]
         else:
-            raise Exception(f'File {output_file} does not exists')
+            # Not matched patterns are kept so the error is reported for them
+            files = sorted(glob.glob(pattern)) or [pattern]
+        for input_file in files:
+            if input_file not in result:
+                result.append(input_file)
+    return result
+
+
+def process_file(input_file, options) -> tuple:
+    """
+    Process one file, returns (input_file, error message or None, metrics or None)
+    """
+    obj = None
+    try:
+        obj = Neptune_Thumbnail(input_file, **options)
+        obj.run()
+        return (input_file, None, obj.metrics())
+    except Exception as ex:
+        logger.exception(f'Error occurred while processing {input_file}')
+        return (input_file, str(ex) or type(ex).__name__, obj.metrics() if obj is not None else None)
+
+
+def batch_worker_init(debug):
+    # Workers append to the log started by the main process
+    setup_logging(debug, 'a')
+    # Worker processes many files, so numpy import pays off
+    import lib_col_pic
+    lib_col_pic.enable_numpy()
+
+
+def run_batch(input_files, options, jobs=None, metrics=None) -> int:
+    """
+    Process files in pool of worker processes and report result for every file, returns number of failed files
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    logger.info(f'Processing {len(input_files)} files using {jobs or os.cpu_count()} workers')
+    results = {}
+    debug = options.get('debug', False)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=batch_worker_init, initargs=(debug,)) as executor:
+        futures = {executor.submit(process_file, input_file, options): input_file for input_file in input_files}
+        for future in as_completed(futures):
+            try:
+                (input_file, error, file_metrics) = future.result()
+            except Exception as ex:
+                # Worker process died
+                (input_file, error, file_metrics) = (futures[future], str(ex) or type(ex).__name__, None)
+            results[input_file] = error
+            if metrics is not None:
+                metrics.add(input_file, error, file_metrics)
+
+    # Result of every file is reported on console as well
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(console)
+    try:
+        failed = 0
+        for input_file in input_files:
+            error = results[input_file]
+            if error is None:
+                logger.info(f'OK     {input_file}')
+            else:
+                failed += 1
+                logger.error(f'FAILED {input_file}: {error}')
+        logger.info(f'Batch completed: {len(input_files) - failed} succeeded, {failed} failed')
+    finally:
+        logger.removeHandler(console)
+    return failed
+
+
+def already_processed(input_file) -> bool:
+    """
+    Files processed before start with the Neptune image
+    """
+    try:
+        with open(input_file, 'rb') as input:
+            head = input.read(8)
+        compression = lib_compress.detect(head)
+        if compression is not None:
+            with lib_compress.open_input(input_file, compression) as input:
+                head = input.read(8)
+        return head in (b';gimage:', b';simage:')
+    except Exception:
+        # Truncated compressed file or zstandard module missing
+        return False
+
+
+def daemon_worker_init(debug):
+    batch_worker_init(debug)
+    # Interrupt is handled by the daemon process, which lets workers complete queued files.
+    # Terminated worker never leaves half-written g-code as output is written to temporary file
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def daemon_terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_daemon(directories, options, jobs=None, queue_size=16, polling=False, metrics=None):
+    """
+    Watch directories and process every new (completely written) g-code file till interrupted
+    """
+    import threading
 
-        logger.info('G-code file modification completed')
+    from concurrent.futures import ProcessPoolExecutor
+
+    import lib_watch
+
+    watcher = lib_watch.create_watcher(directories, GCODE_PATTERNS, polling)
+    slots = threading.BoundedSemaphore(queue_size)
+    lock = threading.Lock()
+    in_progress = set()
+    # Signatures of files written by us, so the events caused by our own os.replace() are ignored
+    written = {}
+
+    def done(future):
+        try:
+            (input_file, error, file_metrics) = future.result()
+        except Exception as ex:
+            # Worker process died
+            (input_file, error, file_metrics) = (future.input_file, str(ex) or type(ex).__name__, None)
+        if metrics is not None:
+            metrics.add(input_file, error, file_metrics)
+        with lock:
+            written[input_file] = lib_watch.file_signature(input_file)
+            in_progress.discard(input_file)
+        slots.release()
+        if error is None:
+            logger.info(f'OK     {input_file}')
+        else:
+            logger.error(f'FAILED {input_file}: {error}')
+
+    signal.signal(signal.SIGTERM, daemon_terminate)
+    logger.info(f'Daemon started: {jobs or os.cpu_count()} workers, queue size {queue_size}')
+    with ProcessPoolExecutor(max_workers=jobs, initializer=daemon_worker_init, initargs=(options.get('debug', False),)) as executor:
+        try:
+            for input_file in watcher.changes():
+                with lock:
+                    if input_file in in_progress or lib_watch.file_signature(input_file) == written.get(input_file):
+                        continue
+                if already_processed(input_file):
+                    continue
+                # Blocks when queue is full
+                slots.acquire()
+                with lock:
+                    in_progress.add(input_file)
+                logger.info(f'Queued {input_file}')
+                future = executor.submit(process_file, input_file, options)
+                future.input_file = input_file
+                future.add_done_callback(done)
+        except KeyboardInterrupt:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            logger.info('Daemon stopped, waiting for queued files')
 
 
 if __name__ == '__main__':
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
+    lib_startup.stage('imports')
     try:
         parser = argparse.ArgumentParser(prog=path.basename(__file__))
         parser.add_argument(
             'input_file',
             metavar='gcode-files',
             type=str,
-            help='G-code file to be processed.',
+            nargs='+',
+            help='G-code files to be processed (glob patterns and directories are accepted).',
+        )
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=None,
+            help='Number of worker processes when more than one file is processed (default: number of CPUs)',
         )
         parser.add_argument(
             '--old_printer',
@@ -546,24 +1758,122 @@ if __name__ == '__main__':
             action='store_true',
             help='Original image should be modified for light Klipper theme',
         )
+        parser.add_argument(
+            '--single_pass',
+            default=False,
+            action='store_true',
+            help='Read input file only once (content is kept in temporary file until thumbnail is ready)',
+        )
+        parser.add_argument(
+            '--cache_dir',
+            default=None,
+            help='Directory to cache encoded images in (re-sliced models with the same thumbnail and texts are not encoded again)',
+        )
+        parser.add_argument(
+            '--cache_size',
+            type=int,
+            default=CACHE_SIZE // (1024 * 1024),
+            help='Max size of cache directory in MB',
+        )
+        parser.add_argument(
+            '--output_compression',
+            default=None,
+            choices=['none', lib_compress.GZIP, lib_compress.ZSTD],
+            help='Compress output g-code (default: compressed the same way as input file)',
+        )
+        parser.add_argument(
+            '--compression_level',
+            type=int,
+            default=None,
+            help='Compression level of output g-code (default: 6 for gzip, 3 for zstd)',
+        )
+        parser.add_argument(
+            '--compression_threads',
+            type=int,
+            default=0,
+            help='Number of zstd compression threads (-1 for number of CPUs, 0 to compress in processing thread)',
+        )
+        parser.add_argument(
+            '--metrics_file',
+            default=None,
+            help='Append metrics of every processed file (stage timings, sizes) to the file as JSON lines',
+        )
+        parser.add_argument(
+            '--metrics_textfile',
+            default=None,
+            help='Write metrics totals into the file in Prometheus text format (for node-exporter textfile collector)',
+        )
+        parser.add_argument(
+            '--daemon',
+            default=False,
+            action='store_true',
+            help='Keep running, watch specified directories and process new g-code files',
+        )
+        parser.add_argument(
+            '--queue_size',
+            type=int,
+            default=16,
+            help='Max number of files waiting for processing in daemon mode',
+        )
+        parser.add_argument(
+            '--polling',
+            default=False,
+            action='store_true',
+            help='Watch directories by polling instead of inotify in daemon mode (e.g. for network shares)',
+        )
         parser.add_argument(
             '--debug',
             default=False,
             action='store_true',
             help='Output image and write additional info into log file',
         )
+        parser.add_argument(
+            '--profile_startup', '--profile-startup',
+            default=False,
+            action='store_true',
+            help='Print time spent in imports and startup stages',
+        )
 
         args = parser.parse_args()
-        obj = Neptune_Thumbnail(
-            args.input_file,
+        lib_startup.stage('arguments')
+        setup_logging(args.debug)
+        lib_startup.stage('logging')
+        options = dict(
             debug=args.debug,
             image_size=args.image_size,
             old_printer=args.old_printer,
             short_duration_format=args.short_duration_format,
             update_original_image=args.update_original_image,
-            original_image_light_theme=args.original_image_light_theme
+            original_image_light_theme=args.original_image_light_theme,
+            single_pass=args.single_pass,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size * 1024 * 1024,
+            output_compression=args.output_compression,
+            compression_level=args.compression_level,
+            compression_threads=args.compression_threads,
         )
-        obj.run()
+        metrics = None
+        if args.metrics_file is not None or args.metrics_textfile is not None:
+            import lib_metrics
+            metrics = lib_metrics.MetricsSink(args.metrics_file, args.metrics_textfile)
+        if args.daemon:
+            run_daemon(args.input_file, options, args.jobs, args.queue_size, args.polling, metrics)
+            sys.exit(0)
+        input_files = expand_input_files(args.input_file)
+        failed = 0
+        if len(input_files) == 1:
+            if metrics is None:
+                obj = Neptune_Thumbnail(input_files[0], **options)
+                obj.run()
+            else:
+                metrics.add(*process_file(input_files[0], options))
+        else:
+            failed = run_batch(input_files, options, args.jobs, metrics)
+        lib_startup.stage('processing')
+        if args.profile_startup:
+            lib_startup.report()
+        # Scripts running the batch see failed files
+        sys.exit(1 if failed else 0)
     except Exception as ex:
         logger.exception('Error occurred while running application.')
 